@@ -0,0 +1,350 @@
+import ast
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fixtures import sample_transcript
+
+# 本地替身服务：模拟 AssemblyAI 与 OpenAI 兼容接口，可配置延迟与错误率，用于基准测试 / 压测
+# translate_fault_rate 模拟模型不守格式的翻译结果（丢掉 id 并合并 / 拆分片段、漏掉片段），用于验证修复逻辑
+
+
+class FakeServer:
+    def __init__(self, handler_cls, host="127.0.0.1", port=0):
+        handler = type(handler_cls.__name__, (handler_cls,), {"backend": self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    backend = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(chunks)
+        length = int(self.headers.get("Content-Length", "0"))
+        return self.rfile.read(length) if length else b""
+
+    def send_json(self, status: int, body, headers: dict = None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _sleep_latency(mean_ms: float, jitter: float):
+    # 对数正态分布的延迟，jitter 越大长尾越明显
+    if mean_ms <= 0:
+        return
+    delay = random.lognormvariate(0, jitter) * mean_ms if jitter > 0 else mean_ms
+    time.sleep(delay / 1000)
+
+
+# ====== AssemblyAI 替身 ======
+class _AsrHandler(_JsonHandler):
+    def do_POST(self):
+        backend: FakeAssemblyAI = self.backend
+        body = self.read_body()
+        if self.path.startswith("/v2/upload"):
+            _sleep_latency(backend.upload_latency_ms, backend.jitter)
+            upload_id = uuid.uuid4().hex
+            backend.uploaded_bytes += len(body)
+            self.send_json(200, {"upload_url": f"{backend.url}/uploads/{upload_id}"})
+        elif self.path.startswith("/v2/transcript"):
+            request = json.loads(body or b"{}")
+            self.send_json(200, backend.create(request.get("audio_url")))
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_GET(self):
+        backend: FakeAssemblyAI = self.backend
+        match = re.match(r"^/v2/transcript/([^/?]+)", self.path)
+        if not match:
+            self.send_json(404, {"error": "not found"})
+            return
+        transcript = backend.get(match.group(1))
+        if transcript is None:
+            self.send_json(404, {"error": "transcript not found"})
+        else:
+            self.send_json(200, transcript)
+
+
+class FakeAssemblyAI(FakeServer):
+    def __init__(
+        self,
+        transcript: dict = None,
+        upload_latency_ms: float = 50,
+        processing_ms: float = 500,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        **kwargs,
+    ):
+        super().__init__(_AsrHandler, **kwargs)
+        self.transcript = transcript or sample_transcript()
+        self.upload_latency_ms = upload_latency_ms
+        self.processing_ms = processing_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.uploaded_bytes = 0
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, audio_url) -> dict:
+        transcript_id = str(uuid.uuid4())
+        delay = self.processing_ms
+        if self.jitter > 0:
+            delay *= random.lognormvariate(0, self.jitter)
+        with self._lock:
+            self._jobs[transcript_id] = {
+                "audio_url": audio_url,
+                "ready_at": time.time() + delay / 1000,
+                "failed": random.random() < self.error_rate,
+            }
+        return {"id": transcript_id, "status": "queued", "audio_url": audio_url}
+
+    def get(self, transcript_id) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(transcript_id)
+        if job is None:
+            return None
+        if time.time() < job["ready_at"]:
+            return {
+                "id": transcript_id,
+                "status": "processing",
+                "audio_url": job["audio_url"],
+            }
+        if job["failed"]:
+            return {
+                "id": transcript_id,
+                "status": "error",
+                "audio_url": job["audio_url"],
+                "error": "fake transcription error",
+            }
+        return dict(
+            self.transcript,
+            id=transcript_id,
+            status="completed",
+            audio_url=job["audio_url"],
+        )
+
+
+# ====== OpenAI 兼容接口替身 ======
+FAKE_PHRASE = "这是一句模拟的翻译，用于基准测试，长度与原文大致成比例。"
+
+
+def _fake_translation(text: str) -> str:
+    n = max(4, len(text) // 3)
+    return (FAKE_PHRASE * (n // len(FAKE_PHRASE) + 1))[:n]
+
+
+def _parse_literal(raw: str):
+    # 提示词模板会把 Python 对象直接渲染成字符串，可能是 JSON，也可能是 repr
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return ast.literal_eval(raw)
+
+
+class _LlmHandler(_JsonHandler):
+    def do_POST(self):
+        backend: FakeOpenAI = self.backend
+        request = json.loads(self.read_body() or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "not found"}})
+            return
+        backend.calls += 1
+        _sleep_latency(backend.latency_ms, backend.jitter)
+        if random.random() < backend.error_rate:
+            if random.random() < 0.5:
+                self.send_json(
+                    429,
+                    {"error": {"message": "rate limited", "type": "rate_limit"}},
+                    {"Retry-After": "1"},
+                )
+            else:
+                self.send_json(500, {"error": {"message": "fake server error"}})
+            return
+        messages = request.get("messages", [])
+        user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        content = backend.respond(user)
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 2
+        completion_tokens = len(content) // 2
+        self.send_json(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+
+class FakeOpenAI(FakeServer):
+    def __init__(
+        self,
+        latency_ms: float = 200,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        translate_fault_rate: float = 0.0,
+        **kwargs,
+    ):
+        super().__init__(_LlmHandler, **kwargs)
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.translate_fault_rate = translate_fault_rate
+        self.calls = 0
+        self.faults = 0
+
+    def respond(self, user_message: str) -> str:
+        _, _, payload = user_message.partition("\n\n")
+        if "翻译" in user_message.split("\n\n")[0]:
+            items = _parse_literal(payload)
+            if items and "texts" in items[0]:
+                # 批量翻译：每组 {"id", "texts"}
+                translated = [
+                    dict(group, texts=_fake_translations(group["texts"]))
+                    for group in items
+                ]
+            else:
+                translated = _fake_translations(items)
+                if random.random() < self.translate_fault_rate:
+                    self.faults += 1
+                    translated = _faulty_translations(translated)
+            return json.dumps(translated, ensure_ascii=False)
+        # 拆分请求：按最大长度切块，停顿标点处断开
+        match = re.search(r"最大长度\s*(\d+)", user_message)
+        max_length = int(match.group(1)) if match else 10
+        try:
+            text = _parse_literal(payload)
+        except (ValueError, SyntaxError):
+            text = payload
+        if isinstance(text, list):
+            # 批量拆分：每段 {"id", "text"}
+            results = [
+                {"id": item["id"], "split_sentences": _fake_split(item["text"], max_length)}
+                for item in text
+            ]
+            return json.dumps(results, ensure_ascii=False)
+        text = text.get("text", "") if isinstance(text, dict) else str(text)
+        return json.dumps(
+            {"split_sentences": _fake_split(text, max_length)}, ensure_ascii=False
+        )
+
+
+def _fake_translations(items: list) -> list:
+    return [dict(item, text=_fake_translation(item.get("text", ""))) for item in items]
+
+
+def _faulty_translations(items: list) -> list:
+    """不守格式的翻译结果：丢掉 id 并合并相邻两段或把一段拆成两段，或保留 id 但漏掉一段"""
+    if not items:
+        return items
+    fault = random.choice(("merge", "split", "drop"))
+    i = random.randrange(len(items))
+    if fault == "drop":
+        return items[:i] + items[i + 1 :]
+    texts = [item["text"] for item in items]
+    if fault == "merge" and len(texts) > 1:
+        i = min(i, len(texts) - 2)
+        texts[i : i + 2] = [texts[i] + texts[i + 1]]
+    else:
+        half = len(texts[i]) // 2
+        texts[i : i + 1] = [texts[i][:half], texts[i][half:]]
+    return [{"text": t} for t in texts]
+
+
+def _fake_split(text: str, max_length: int) -> list[str]:
+    pieces = [p for p in re.split(r"[，。；：、,.;:\s]+", text) if p]
+    return [
+        p[i : i + max_length] for p in pieces for i in range(0, len(p), max_length)
+    ]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="AssemblyAI / OpenAI 本地替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--asr-port", type=int, default=8801)
+    parser.add_argument("--llm-port", type=int, default=8802)
+    parser.add_argument("--asr-processing-ms", type=float, default=500)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--jitter", type=float, default=0.0, help="对数正态延迟的 sigma")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--translate-fault-rate", type=float, default=0.0, help="翻译结果不守格式的比例"
+    )
+    args = parser.parse_args()
+
+    asr = FakeAssemblyAI(
+        processing_ms=args.asr_processing_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        host=args.host,
+        port=args.asr_port,
+    ).start()
+    llm = FakeOpenAI(
+        latency_ms=args.llm_latency_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        translate_fault_rate=args.translate_fault_rate,
+        host=args.host,
+        port=args.llm_port,
+    ).start()
+    print(f"ASSEMBLYAI_BASE_URL={asr.url}")
+    print(f"OPENAI_BASE_URL={llm.url}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        asr.stop()
+        llm.stop()
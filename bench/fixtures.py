@@ -0,0 +1,97 @@
+import ast
+import copy
+import os
+import subprocess
+import sys
+from functools import lru_cache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, "src")
+if SRC not in sys.path:
+    sys.path.insert(0, SRC)
+
+
+@lru_cache(maxsize=1)
+def load_sample_transcript() -> dict:
+    """读取 src/trans.py 末尾 __main__ 中的 AssemblyAI 样例响应（data 变量）"""
+    with open(os.path.join(SRC, "trans.py"), "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Name)
+            and node.targets[0].id == "data"
+        ):
+            return ast.literal_eval(node.value)
+    raise RuntimeError("src/trans.py 中未找到样例转录数据")
+
+
+def sample_transcript() -> dict:
+    return copy.deepcopy(load_sample_transcript())
+
+
+def _shift_words(words, offset):
+    return [dict(w, start=w["start"] + offset, end=w["end"] + offset) for w in words]
+
+
+def synthetic_transcript(min_words: int = 0, min_duration_ms: int = 0) -> dict:
+    """重复样例中的 utterances（时间轴顺延），生成至少 min_words 个词 / min_duration_ms 时长的转录"""
+    sample = load_sample_transcript()
+    base_utterances = sample["utterances"]
+    period = max(u["end"] for u in base_utterances) + 1000
+    utterances = []
+    words = []
+    offset = 0
+    while len(words) < min_words or offset < min_duration_ms or not utterances:
+        for u in base_utterances:
+            shifted_words = _shift_words(u["words"], offset)
+            utterances.append(
+                dict(
+                    u,
+                    start=u["start"] + offset,
+                    end=u["end"] + offset,
+                    words=shifted_words,
+                )
+            )
+            words.extend(shifted_words)
+        offset += period
+    result = copy.deepcopy(sample)
+    result["utterances"] = utterances
+    result["words"] = words
+    result["text"] = " ".join(u["text"] for u in utterances)
+    result["audio_duration"] = offset // 1000
+    return result
+
+
+def generate_video(path: str, seconds: int, width: int, height: int) -> str:
+    """用 ffmpeg 的测试信号源生成带音轨的测试视频（已存在则直接复用）"""
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            f"testsrc=size={width}x{height}:rate=25:duration={seconds}",
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency=440:duration={seconds}",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            "-c:a",
+            "aac",
+            "-shortest",
+            path,
+        ],
+        check=True,
+    )
+    return path
@@ -0,0 +1,334 @@
+import itertools
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from fixtures import ROOT, SRC, generate_video, synthetic_transcript
+from fake_backends import FakeAssemblyAI, FakeOpenAI
+from pipeline_bench import percentile
+
+# HTTP 接口压测：逐级增加并发客户端，混合上传文件与 video_path 两种请求，
+# 记录延迟分位数、错误率、线程池占用与 RSS，输出可跨版本对比的 JSON 报告
+#
+#   python bench/loadtest.py --ramp 1,2,4,8 --step-seconds 60 --output load_v1.json
+#   python bench/loadtest.py --ramp 1,2,4,8 --compare load_v1.json
+
+
+def encode_multipart(fields: dict, files: dict) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n".encode("utf-8")
+        )
+    for name, (filename, content) in files.items():
+        header = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+            f'filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        )
+        parts.append(header.encode("utf-8") + content + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def scrape_metrics(url: str) -> dict:
+    """读取服务端 /metrics 中的线程池与内存指标"""
+    try:
+        with urllib.request.urlopen(f"{url}/metrics", timeout=5) as resp:
+            text = resp.read().decode("utf-8")
+    except Exception:
+        return {}
+    result = {}
+    for name in (
+        "videotingyi_threadpool_busy",
+        "videotingyi_threadpool_size",
+        "videotingyi_process_rss_bytes",
+        "videotingyi_inflight_jobs",
+        "videotingyi_inflight_encodes",
+    ):
+        match = re.search(rf"^{name} (\S+)$", text, re.MULTILINE)
+        if match:
+            result[name] = float(match.group(1))
+    return result
+
+
+class LoadTest:
+    def __init__(self, url, video_path, upload_ratio, endpoint, timeout):
+        self.url = url.rstrip("/")
+        self.video_path = video_path
+        self.upload_ratio = upload_ratio
+        self.endpoint = endpoint
+        self.timeout = timeout
+        with open(video_path, "rb") as f:
+            self.video_bytes = f.read()
+        self._lock = threading.Lock()
+        self._path_pool = []
+        self._mtime_seq = itertools.count()
+
+    def prepare_path_pool(self, size: int, directory: str):
+        # 每个客户端使用独立的视频副本，避免被单飞合并（合并按 路径+大小+mtime 判断）
+        # 每次请求前再刷新副本的 mtime，使去重键各不相同，重复请求不会复用已有任务目录
+        os.makedirs(directory, exist_ok=True)
+        for i in range(len(self._path_pool), size):
+            path = os.path.join(directory, f"client_{i}.mp4")
+            shutil.copyfile(self.video_path, path)
+            self._path_pool.append(os.path.abspath(path))
+
+    def request_once(self, client_idx: int) -> dict:
+        if random.random() < self.upload_ratio:
+            kind = "upload"
+            # 末尾追加随机字节使内容哈希不同，避免重复请求被合并
+            content = self.video_bytes + uuid.uuid4().bytes
+            body, content_type = encode_multipart({}, {"file": ("input.mp4", content)})
+        else:
+            kind = "video_path"
+            path = self._path_pool[client_idx]
+            mtime_ns = time.time_ns() + next(self._mtime_seq)
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+            body, content_type = encode_multipart({"video_path": path}, {})
+        req = urllib.request.Request(
+            f"{self.url}{self.endpoint}",
+            data=body,
+            method="POST",
+            headers={
+                "Content-Type": content_type,
+                # 每个请求使用不同的来源 IP，避免触发 IP 限流
+                "X-Forwarded-For": f"10.{client_idx % 256}.{random.randint(0, 255)}."
+                f"{random.randint(1, 254)}",
+            },
+        )
+        start = time.perf_counter()
+        status = 0
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = -1
+        return {
+            "kind": kind,
+            "status": status,
+            "latency": time.perf_counter() - start,
+            "ok": 200 <= status < 300,
+        }
+
+    def run_step(self, concurrency: int, seconds: float) -> dict:
+        stop_at = time.monotonic() + seconds
+        step_results = []
+
+        def client(idx):
+            while time.monotonic() < stop_at:
+                r = self.request_once(idx)
+                with self._lock:
+                    step_results.append(r)
+
+        samples = []
+
+        def sampler():
+            while time.monotonic() < stop_at:
+                samples.append(scrape_metrics(self.url))
+                time.sleep(1)
+
+        threads = [
+            threading.Thread(target=client, args=(i,)) for i in range(concurrency)
+        ]
+        threads.append(threading.Thread(target=sampler))
+        wall_start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - wall_start
+
+        latencies = [r["latency"] for r in step_results if r["ok"]]
+        errors = [r for r in step_results if not r["ok"]]
+
+        def max_sample(name):
+            values = [s[name] for s in samples if name in s]
+            return max(values) if values else None
+
+        return {
+            "concurrency": concurrency,
+            "requests": len(step_results),
+            "succeeded": len(latencies),
+            "error_rate": round(len(errors) / len(step_results), 4)
+            if step_results
+            else 0.0,
+            "status_counts": {
+                str(s): sum(1 for r in step_results if r["status"] == s)
+                for s in sorted({r["status"] for r in step_results})
+            },
+            "throughput_per_minute": round(len(latencies) / wall * 60, 3),
+            "latency_p50": round(percentile(latencies, 50), 3),
+            "latency_p95": round(percentile(latencies, 95), 3),
+            "latency_p99": round(percentile(latencies, 99), 3),
+            "threadpool_busy_max": max_sample("videotingyi_threadpool_busy"),
+            "threadpool_size": max_sample("videotingyi_threadpool_size"),
+            "inflight_encodes_max": max_sample("videotingyi_inflight_encodes"),
+            "rss_bytes_max": max_sample("videotingyi_process_rss_bytes"),
+        }
+
+
+def start_server(port: int, env: dict) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(SRC, "main.py")]
+        + ["-p", str(port), "-H", "127.0.0.1"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if scrape_metrics(f"http://127.0.0.1:{port}"):
+            return proc
+        time.sleep(0.5)
+    proc.kill()
+    raise RuntimeError("API 服务启动超时")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def print_report(report: dict, baseline: dict = None):
+    base_steps = {s["concurrency"]: s for s in (baseline or {}).get("steps", [])}
+    print(f"\n版本: {report['revision']}  端点: {report['endpoint']}")
+    for s in report["steps"]:
+        line = (
+            f"c={s['concurrency']:<4} req={s['requests']:<6} "
+            f"err={s['error_rate']:<7} thr={s['throughput_per_minute']:<8}/min "
+            f"p50={s['latency_p50']:<8} p95={s['latency_p95']:<8} "
+            f"p99={s['latency_p99']:<8} "
+            f"pool={s['threadpool_busy_max']}/{s['threadpool_size']} "
+            f"rss={(s['rss_bytes_max'] or 0) / 1024 / 1024:.0f}MB"
+        )
+        base = base_steps.get(s["concurrency"])
+        if base:
+            d_thr = s["throughput_per_minute"] - base["throughput_per_minute"]
+            d_p95 = s["latency_p95"] - base["latency_p95"]
+            d_err = s["error_rate"] - base["error_rate"]
+            line += f"  | Δthr={d_thr:+.2f} Δp95={d_p95:+.3f} Δerr={d_err:+.4f}"
+        print(line)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="HTTP 接口压测")
+    parser.add_argument("--url", default=None, help="压测已有服务；不指定则本地启动服务与替身")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--endpoint", default="/transcribe")
+    parser.add_argument("--ramp", default="1,2,4,8", help="逐级并发客户端数")
+    parser.add_argument("--step-seconds", type=float, default=60)
+    parser.add_argument("--upload-ratio", type=float, default=0.5)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--video", default="10x640x360", help="测试视频规格 时长x宽x高")
+    parser.add_argument("--asr-processing-ms", type=float, default=500)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", default=None, help="报告 JSON 输出路径")
+    parser.add_argument("--compare", default=None, help="与之前的报告对比")
+    args = parser.parse_args()
+
+    cache_dir = os.path.join(ROOT, "bench", ".cache")
+    seconds, width, height = (int(x) for x in args.video.split("x"))
+    video_path = generate_video(
+        os.path.join(cache_dir, "videos", f"test_{seconds}s_{width}x{height}.mp4"),
+        seconds,
+        width,
+        height,
+    )
+    ramp = [int(x) for x in args.ramp.split(",")]
+
+    asr = llm = server = None
+    url = args.url
+    try:
+        if url is None:
+            asr = FakeAssemblyAI(
+                transcript=synthetic_transcript(min_duration_ms=seconds * 1000),
+                processing_ms=args.asr_processing_ms,
+                jitter=args.jitter,
+                error_rate=args.error_rate,
+            ).start()
+            llm = FakeOpenAI(
+                latency_ms=args.llm_latency_ms,
+                jitter=args.jitter,
+                error_rate=args.error_rate,
+            ).start()
+            work_dir = os.path.join(cache_dir, f"loadtest_{uuid.uuid4().hex[:8]}")
+            env = dict(
+                os.environ,
+                ASSEMBLYAI_KEY="fake",
+                ASSEMBLYAI_BASE_URL=asr.url,
+                ASSEMBLYAI_POLLING_INTERVAL="0.1",
+                OPENAI_KEY="fake",
+                OPENAI_BASE_URL=f"{llm.url}/v1",
+                WORKSPACE_ROOT=os.path.join(work_dir, "temp"),
+                RATE_LIMIT_BACKEND="memory",
+                JOB_QUEUE_DB=os.path.join(work_dir, "jobs.db"),
+                TRACE_ENABLED="0",
+            )
+            server = start_server(args.port, env)
+            url = f"http://127.0.0.1:{args.port}"
+
+        test = LoadTest(url, video_path, args.upload_ratio, args.endpoint, args.timeout)
+        test.prepare_path_pool(max(ramp), os.path.join(cache_dir, "path_pool"))
+        steps = []
+        for concurrency in ramp:
+            print(f"并发 {concurrency} 压测 {args.step_seconds}s ...")
+            steps.append(test.run_step(concurrency, args.step_seconds))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+        if asr is not None:
+            asr.stop()
+        if llm is not None:
+            llm.stop()
+
+    report = {
+        "revision": git_revision(),
+        "created_at": time.time(),
+        "endpoint": args.endpoint,
+        "video": args.video,
+        "upload_ratio": args.upload_ratio,
+        "fake_backends": {
+            "asr_processing_ms": args.asr_processing_ms,
+            "llm_latency_ms": args.llm_latency_ms,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+        },
+        "steps": steps,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n报告已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fixtures import ROOT, generate_video, synthetic_transcript
+from fake_backends import FakeAssemblyAI, FakeOpenAI
+
+# 端到端基准测试：用本地替身替代 AssemblyAI 与 LLM，统计各阶段耗时与每分钟任务数
+#
+#   python bench/pipeline_bench.py --jobs 4 --concurrency 2 \
+#       --specs 10x640x360,60x1280x720
+
+
+def parse_specs(raw: str) -> list[tuple[int, int, int]]:
+    specs = []
+    for item in raw.split(","):
+        seconds, width, height = (int(x) for x in item.lower().split("x"))
+        specs.append((seconds, width, height))
+    return specs
+
+
+def percentile(values, p) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def stage_delta(before: dict, after: dict) -> dict:
+    result = {}
+    for key, (total, count) in after.items():
+        prev_total, prev_count = before.get(key, (0.0, 0))
+        if count > prev_count:
+            n = count - prev_count
+            result[key[0]] = {
+                "count": n,
+                "mean_seconds": round((total - prev_total) / n, 4),
+                "total_seconds": round(total - prev_total, 4),
+            }
+    return result
+
+
+def run_spec(spec, jobs, concurrency, asr, video_dir) -> dict:
+    from pipeline import run_pipeline
+    from metrics import STAGE_DURATION
+
+    seconds, width, height = spec
+    video_path = generate_video(
+        os.path.join(video_dir, f"test_{seconds}s_{width}x{height}.mp4"),
+        seconds,
+        width,
+        height,
+    )
+    asr.transcript = synthetic_transcript(min_duration_ms=seconds * 1000)
+
+    latencies = []
+    errors = []
+
+    def one_job(_):
+        start = time.perf_counter()
+        try:
+            run_pipeline(video_path)
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+
+    before = STAGE_DURATION.snapshot()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one_job, range(jobs)))
+    wall = time.perf_counter() - wall_start
+    after = STAGE_DURATION.snapshot()
+
+    return {
+        "spec": f"{seconds}s_{width}x{height}",
+        "jobs": jobs,
+        "concurrency": concurrency,
+        "succeeded": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "wall_seconds": round(wall, 3),
+        "jobs_per_minute": round(len(latencies) / wall * 60, 3) if wall else 0.0,
+        "latency_p50": round(percentile(latencies, 50), 3),
+        "latency_p95": round(percentile(latencies, 95), 3),
+        "latency_mean": round(statistics.mean(latencies), 3) if latencies else 0.0,
+        "stages": stage_delta(before, after),
+    }
+
+
+def print_report(results: list[dict]):
+    for r in results:
+        print(
+            f"\n== {r['spec']}  jobs={r['jobs']} concurrency={r['concurrency']} "
+            f"ok={r['succeeded']} err={r['errors']}"
+        )
+        print(
+            f"   {r['jobs_per_minute']} jobs/min  wall={r['wall_seconds']}s  "
+            f"p50={r['latency_p50']}s  p95={r['latency_p95']}s"
+        )
+        for name, s in sorted(
+            r["stages"].items(), key=lambda kv: -kv[1]["total_seconds"]
+        ):
+            print(
+                f"   {name:<24} n={s['count']:<5} mean={s['mean_seconds']:<10} "
+                f"total={s['total_seconds']}"
+            )
+        for e in r["error_samples"]:
+            print(f"   error: {e}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="端到端流程基准测试")
+    parser.add_argument("--jobs", type=int, default=4, help="每种视频规格的任务数")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument(
+        "--specs",
+        default="10x640x360,30x1280x720",
+        help="视频规格列表：时长(秒)x宽x高，逗号分隔",
+    )
+    parser.add_argument("--asr-processing-ms", type=float, default=500)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--translate-fault-rate", type=float, default=0.0, help="翻译结果不守格式的比例"
+    )
+    parser.add_argument(
+        "--video-dir", default=os.path.join(ROOT, "bench", ".cache", "videos")
+    )
+    parser.add_argument("--output", default=None, help="结果 JSON 输出路径")
+    args = parser.parse_args()
+
+    asr = FakeAssemblyAI(
+        processing_ms=args.asr_processing_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+    ).start()
+    llm = FakeOpenAI(
+        latency_ms=args.llm_latency_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        translate_fault_rate=args.translate_fault_rate,
+    ).start()
+    os.environ.update(
+        {
+            "ASSEMBLYAI_KEY": "fake",
+            "ASSEMBLYAI_BASE_URL": asr.url,
+            "ASSEMBLYAI_POLLING_INTERVAL": "0.1",
+            "OPENAI_KEY": "fake",
+            "OPENAI_BASE_URL": f"{llm.url}/v1",
+            "WORKSPACE_ROOT": tempfile.mkdtemp(prefix="videotingyi_bench_"),
+            "TRACE_ENABLED": os.getenv("TRACE_ENABLED", "0"),
+        }
+    )
+
+    try:
+        results = [
+            run_spec(spec, args.jobs, args.concurrency, asr, args.video_dir)
+            for spec in parse_specs(args.specs)
+        ]
+    finally:
+        asr.stop()
+        llm.stop()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {"created_at": time.time(), "python": sys.version, "results": results},
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        print(f"\n结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
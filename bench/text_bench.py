@@ -0,0 +1,376 @@
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+from fixtures import ROOT, synthetic_transcript
+
+# 文本处理微基准：在 1k–500k 词的合成转录上测量断句、拆分、时间分配与断行的吞吐（词/秒），
+# 并与 bench/baselines/text_bench.json 中的基线对比，吞吐下降超过容差且复测仍然回退时以非零状态退出
+#
+#   python bench/text_bench.py                      # 运行并与基线对比
+#   python bench/text_bench.py --sizes 1000,10000   # 只跑小规模
+#   python bench/text_bench.py --update-baseline    # 以本次结果覆盖基线
+
+DEFAULT_SIZES = "1000,10000,100000,500000"
+DEFAULT_BASELINE = os.path.join(ROOT, "bench", "baselines", "text_bench.json")
+CHUNK_SIZE = 20
+# 单次运行已超过 min_seconds 时也至少运行的次数（取中位数需要多个样本）
+MIN_RUNS = 3
+CASES = (
+    "split_sentence_by_dot",
+    "split_text_with_punctuation_check",
+    "generate_subtitle_data",
+    "generate_subtitle_data_weighted",
+    "handle_oversize_sentences",
+    "build_columns",
+    "split_sentences_columnar",
+)
+FAKE_PHRASE = "这是一句模拟的翻译，用于基准测试。长度与原文大致成比例；含有停顿符号、小数3.14与问号？"
+
+
+def fake_split_sentences(text: str) -> list[str]:
+    # 与 LLM 拆分结果形态相近：每段 4~12 个汉字
+    n = max(4, len(text) // 3)
+    translated = (FAKE_PHRASE * (n // len(FAKE_PHRASE) + 1))[:n]
+    pieces = []
+    i = 0
+    while i < len(translated):
+        step = 4 + (i % 9)
+        pieces.append(translated[i : i + step])
+        i += step
+    return pieces
+
+
+def calibration_workload():
+    """固定的纯 Python 负载（字符串拼接、切片、dict 创建），用于在不同机器间归一化吞吐"""
+    items = []
+    text = ""
+    for i in range(200000):
+        text += "字"
+        if len(text) > 30:
+            items.append({"text": text[:15], "start": i, "end": i + 1})
+            text = ""
+    return items
+
+
+def _timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def build_cases(transcript: dict) -> dict:
+    from utils import (
+        generate_subtitle_data,
+        split_sentence_by_dot,
+        split_text_with_punctuation_check,
+        SubtitleSize,
+        VideoDimension,
+    )
+    from subtitle import SubtitleCreator
+    from columnar import TranscriptColumns
+
+    utterances = transcript["utterances"]
+    translated_texts = [
+        {"split_sentences": fake_split_sentences(u["text"])} for u in utterances
+    ]
+    long_texts = ["".join(t["split_sentences"]) for t in translated_texts]
+    subtitle_data = generate_subtitle_data(utterances, translated_texts)
+    columns = TranscriptColumns.from_response(transcript)
+    subtitle_size = SubtitleSize(
+        video_dim=VideoDimension(width=640, height=360), font_size=18
+    )
+
+    def run_split_sentence_by_dot():
+        split_sentence_by_dot(transcript)
+
+    def run_split_text_with_punctuation_check():
+        for text in long_texts:
+            split_text_with_punctuation_check(text, CHUNK_SIZE)
+
+    def run_generate_subtitle_data():
+        generate_subtitle_data(utterances, translated_texts)
+
+    def run_generate_subtitle_data_weighted():
+        generate_subtitle_data(utterances, translated_texts, weight_by_words=True)
+
+    def run_handle_oversize_sentences():
+        creator = SubtitleCreator(subtitle_data, subtitle_size=subtitle_size)
+        creator.handle_oversize_sentences()
+
+    def run_build_columns():
+        TranscriptColumns.from_response(transcript)
+
+    def run_split_sentences_columnar():
+        columns.split_sentences()
+
+    return {
+        "split_sentence_by_dot": run_split_sentence_by_dot,
+        "split_text_with_punctuation_check": run_split_text_with_punctuation_check,
+        "generate_subtitle_data": run_generate_subtitle_data,
+        "generate_subtitle_data_weighted": run_generate_subtitle_data_weighted,
+        "handle_oversize_sentences": run_handle_oversize_sentences,
+        "build_columns": run_build_columns,
+        "split_sentences_columnar": run_split_sentences_columnar,
+    }
+
+
+def perturb(transcript: dict, seed: int = 0) -> dict:
+    """在语句文本上制造与词文本的差异：删改标点、多余空白、大小写，词本身不变"""
+    rng = random.Random(seed)
+    utterances = []
+    for u in transcript["utterances"]:
+        tokens = []
+        for t in u["text"].split(" "):
+            r = rng.random()
+            if r < 0.1:
+                t = t.rstrip(",;:")
+            elif r < 0.2:
+                t = t.upper()
+            elif r < 0.25:
+                t = t + " "
+            elif r < 0.3:
+                t = '"' + t + '"'
+            tokens.append(t)
+        utterances.append(dict(u, text=" ".join(tokens)))
+    return dict(transcript, utterances=utterances)
+
+
+def alignment_accuracy(transcript: dict) -> float:
+    """句子归一化文本与所对齐词的归一化文本完全一致的比例（扰动后的输入应为 1.0）"""
+    from columnar import TranscriptColumns, normalize
+
+    sentences = TranscriptColumns.from_response(perturb(transcript)).split_sentences()
+    words = sentences.words
+    ok = 0
+    for i in range(len(sentences)):
+        aligned = "".join(normalize(words.word_text(j)) for j in sentences.word_range(i))
+        ok += aligned == normalize(sentences.segment_text(i))
+    return ok / len(sentences) if len(sentences) else 1.0
+
+
+# 断行示例：(文本, 视频宽度, 字号, 期望的各屏)；停顿处放得下时断点必须落在短语边界，不拆开词
+LAYOUT_EXAMPLES = (
+    (
+        "这是一个非常非常长的字幕，用来测试断行是否正确工作，以及在多行的情况下是否能够正确地处理",
+        640,
+        18,
+        [["这是一个非常非常长的字幕 用来测试断行是否正确工作", "以及在多行的情况下是否能够正确地处理"]],
+    ),
+    (
+        "这是一个非常非常长的字幕，用来测试断行是否正确工作，以及在多行情况下的表现",
+        640,
+        18,
+        [["这是一个非常非常长的字幕", "用来测试断行是否正确工作 以及在多行情况下的表现"]],
+    ),
+)
+
+
+def layout_failures() -> list[str]:
+    """断行结果与示例不一致的条目"""
+    from linebreak import get_metrics, layout, line_width
+
+    failures = []
+    for text, width, font_size, expected in LAYOUT_EXAMPLES:
+        screens = layout(text, line_width(width), get_metrics(font_size))
+        if screens != expected:
+            failures.append(f"layout[{text[:8]}…]: {screens}")
+    return failures
+
+
+def measure(fn, repeat: int, min_seconds: float) -> tuple[float, float]:
+    """返回 (耗时中位数, 校准分数)：至少运行 repeat 次且累计超过 min_seconds，单次较慢时至少 MIN_RUNS 次
+
+    校准负载与被测函数交替运行（两者累计耗时大致相当），机器负载在运行期间变化时两者同步受影响；
+    运行前回收垃圾并暂停 GC，避免上一个条目遗留的对象在本条目计时内触发回收
+    """
+    timings = []
+    calibrations = []
+    since_calibration = 0.0
+    gc.collect()
+    gc.disable()
+    try:
+        while True:
+            if not calibrations or since_calibration >= calibrations[-1]:
+                calibrations.append(_timed(calibration_workload))
+                since_calibration = 0.0
+            timings.append(_timed(fn))
+            since_calibration += timings[-1]
+            runs = len(timings)
+            if runs >= repeat and sum(timings) >= min_seconds:
+                break
+            if runs >= MIN_RUNS and timings[-1] >= min_seconds:
+                break
+    finally:
+        gc.enable()
+    return statistics.median(timings), 1.0 / statistics.median(calibrations)
+
+
+def run(sizes: list[int], cases: list[str], repeat: int, min_seconds: float):
+    results = {}
+    accuracy = {}
+    for size in sizes:
+        transcript = synthetic_transcript(min_words=size)
+        n_words = len(transcript["words"])
+        fns = build_cases(transcript)
+        for name in cases:
+            seconds, calibration = measure(fns[name], repeat, min_seconds)
+            results.setdefault(name, {})[str(size)] = {
+                "words": n_words,
+                "seconds": round(seconds, 6),
+                "words_per_second": round(n_words / seconds, 1),
+                "calibration": round(calibration, 4),
+            }
+            print(
+                f"{name:<36} {size:>7} 词  {seconds * 1000:>10.2f} ms  "
+                f"{n_words / seconds:>14,.0f} 词/秒"
+            )
+        if "split_sentences_columnar" in cases:
+            accuracy[str(size)] = alignment_accuracy(transcript)
+            print(f"{'alignment_accuracy':<36} {size:>7} 词  {accuracy[str(size)]:.4f}")
+        del transcript, fns
+    return results, accuracy
+
+
+def relative(words_per_second: float, calibration: float, base: dict) -> float:
+    """吞吐相对基线的比例（按校准分数归一化）"""
+    scale = calibration / base["calibration"]
+    return words_per_second / (base["words_per_second"] * scale)
+
+
+def check(report: dict, baseline: dict, tolerance: float) -> list[tuple[str, str, float]]:
+    """返回吞吐（按校准分数归一化后）低于基线 (1 - tolerance) 的 (函数, 规模, 比例)"""
+    failures = []
+    for name, by_size in report["results"].items():
+        for size, r in by_size.items():
+            base = baseline["results"].get(name, {}).get(size)
+            if not base:
+                continue
+            ratio = relative(r["words_per_second"], r["calibration"], base)
+            mark = "  回退?" if ratio < 1 - tolerance else ""
+            print(f"{name:<36} {size:>7} 词  相对基线 {ratio:>6.2f}x{mark}")
+            if mark:
+                failures.append((name, size, ratio))
+    return failures
+
+
+def confirm(failures, baseline: dict, tolerance: float, rounds: int, repeat, min_seconds):
+    """复测疑似回退的条目，任一轮恢复到容差内即视为噪声，返回仍然回退的条目"""
+    confirmed = []
+    by_size = {}
+    for name, size, ratio in failures:
+        by_size.setdefault(size, []).append((name, ratio))
+    for size, entries in by_size.items():
+        transcript = synthetic_transcript(min_words=int(size))
+        n_words = len(transcript["words"])
+        fns = build_cases(transcript)
+        for name, ratio in entries:
+            base = baseline["results"][name][size]
+            ratios = [ratio]
+            for _ in range(rounds):
+                seconds, calibration = measure(fns[name], repeat, min_seconds)
+                ratios.append(relative(n_words / seconds, calibration, base))
+                if ratios[-1] >= 1 - tolerance:
+                    break
+            summary = ", ".join(f"{r:.2f}x" for r in ratios)
+            if ratios[-1] < 1 - tolerance:
+                print(f"{name:<36} {size:>7} 词  复测仍回退: {summary}")
+                confirmed.append(f"{name}@{size}: {summary}")
+            else:
+                print(f"{name:<36} {size:>7} 词  复测恢复（视为噪声）: {summary}")
+        del transcript, fns
+    return confirmed
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="文本处理微基准与回退检查")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="合成转录的词数，逗号分隔")
+    parser.add_argument("--cases", default=None, help="只运行指定函数，逗号分隔")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-seconds", type=float, default=1.0)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--tolerance", type=float, default=0.3, help="允许的吞吐下降比例"
+    )
+    parser.add_argument(
+        "--confirm", type=int, default=2, help="疑似回退条目的复测轮数，0 表示不复测"
+    )
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--output", default=None, help="结果 JSON 输出路径")
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.sizes.split(",")]
+    cases = args.cases.split(",") if args.cases else list(CASES)
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"未知的函数: {', '.join(sorted(unknown))}")
+
+    results, accuracy = run(sizes, cases, args.repeat, args.min_seconds)
+    calibration = statistics.median(
+        r["calibration"] for by_size in results.values() for r in by_size.values()
+    )
+    print(f"\n校准分数（各条目中位数）: {calibration:.2f}")
+    report = {
+        "created_at": time.time(),
+        "python": sys.version.split()[0],
+        "machine": platform.machine(),
+        "calibration": round(calibration, 4),
+        "results": results,
+        "alignment_accuracy": accuracy,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        baseline = {"results": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        # 只覆盖本次运行的条目，每个条目带有测量时的校准分数
+        for name, by_size in report["results"].items():
+            for size, r in by_size.items():
+                baseline["results"].setdefault(name, {})[size] = r
+        baseline.update({k: report[k] for k in ("created_at", "python", "machine")})
+        os.makedirs(os.path.dirname(args.baseline) or ".", exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"\n基线已更新: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\n未找到基线 {args.baseline}，使用 --update-baseline 生成")
+        return
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print()
+    failures = check(report, baseline, args.tolerance)
+    if failures and args.confirm > 0:
+        print(f"\n复测 {len(failures)} 个疑似回退条目")
+        failures = confirm(
+            failures, baseline, args.tolerance, args.confirm, args.repeat, args.min_seconds
+        )
+    else:
+        failures = [f"{name}@{size}: {ratio:.2f}x" for name, size, ratio in failures]
+    # 对齐正确性不受机器影响，直接要求扰动输入全部对齐
+    failures += [
+        f"alignment_accuracy@{size}: {value:.4f}"
+        for size, value in accuracy.items()
+        if value < 1.0
+    ]
+    failures += layout_failures()
+    if failures:
+        print(f"\n回退（吞吐容差 {args.tolerance:.0%}）: {'; '.join(failures)}")
+        sys.exit(1)
+    print("\n未发现吞吐回退")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import json
+import os
+
+from metrics import stage as metrics_stage
+from tracing import span
+
+
+# 阶段检查点：每个阶段的输出以 JSON 保存在任务目录下，重试 / 重启时跳过已完成的阶段
+class CheckpointStore:
+    def __init__(self, job_dir: str):
+        self.dir = os.path.join(job_dir, "checkpoints")
+
+    def _path(self, stage: str) -> str:
+        return os.path.join(self.dir, f"{stage}.json")
+
+    def has(self, stage: str) -> bool:
+        return os.path.exists(self._path(stage))
+
+    def mtime(self, stage: str) -> float:
+        return os.path.getmtime(self._path(stage))
+
+    def load(self, stage: str):
+        with open(self._path(stage), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save(self, stage: str, value):
+        # 先写临时文件再原子替换，避免进程中断留下半个检查点
+        os.makedirs(self.dir, exist_ok=True)
+        path = self._path(stage)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def run(self, stage: str, fn, *args, **kwargs):
+        """已有检查点则直接读取，否则执行 fn 并保存结果（结果需可 JSON 序列化）"""
+        if self.has(stage):
+            print(f"从检查点恢复阶段: {stage}")
+            with span(stage, restored=True):
+                return self.load(stage)
+        # 只统计实际执行的耗时，从检查点恢复的阶段不计入
+        with metrics_stage(stage):
+            value = fn(*args, **kwargs)
+        self.save(stage, value)
+        return value
+
+    def completed(self) -> list[str]:
+        if not os.path.isdir(self.dir):
+            return []
+        return sorted(
+            name[: -len(".json")]
+            for name in os.listdir(self.dir)
+            if name.endswith(".json")
+        )
+
+    def clear(self, *stages: str):
+        for stage in stages:
+            try:
+                os.unlink(self._path(stage))
+            except FileNotFoundError:
+                pass
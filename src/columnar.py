@@ -0,0 +1,399 @@
+import re
+import sys
+from array import array
+
+# AssemblyAI 转录结果的列式存储：每个词一条 dict 约数百字节，长视频的转录动辄数十万词
+# 这里把词的开始 / 结束时间、置信度放进 array，说话人编码为整数，词文本拼进同一个字符串用偏移量定位
+# 语句（utterance）与拆分出的句子共用同一张"片段"表结构：时间、置信度、说话人、文本偏移与词区间
+
+SENTENCE_PATTERN = re.compile(r"(?<!\d\.)(?<!\d)(?<![A-Za-z]\.)([.!?。！？]+)\s*")
+NON_WORD = re.compile(r"[\W_]+")
+RESYNC_WINDOW = 16
+RESYNC_MATCH = 3
+
+
+class WordColumns:
+    __slots__ = ("text", "offsets", "start", "end", "confidence", "speaker")
+
+    def __init__(self, text, offsets, start, end, confidence, speaker):
+        self.text = text  # 所有词文本首尾相接
+        self.offsets = offsets  # 第 i 个词为 text[offsets[i]:offsets[i + 1]]
+        self.start = start
+        self.end = end
+        self.confidence = confidence
+        self.speaker = speaker
+
+    def __len__(self):
+        return len(self.start)
+
+    def word_text(self, i) -> str:
+        return self.text[self.offsets[i] : self.offsets[i + 1]]
+
+
+class TranscriptColumns:
+    """一组片段（语句或句子）及其引用的词；split_sentences 返回的新实例与原实例共用词列"""
+
+    __slots__ = (
+        "speakers",
+        "words",
+        "text",
+        "text_offsets",
+        "start",
+        "end",
+        "confidence",
+        "speaker",
+        "word_bounds",
+    )
+
+    def __init__(self, speakers: list, words: WordColumns):
+        self.speakers = speakers  # 说话人编码 -> 名称
+        self.words = words
+        self.text = ""  # 所有片段文本首尾相接
+        self.text_offsets = array("I", [0])
+        self.start = array("q")
+        self.end = array("q")
+        self.confidence = array("d")
+        self.speaker = array("H")
+        # 第 i 个片段包含的词为 [word_bounds[2i], word_bounds[2i + 1])
+        self.word_bounds = array("I")
+
+    def __len__(self):
+        return len(self.start)
+
+    @classmethod
+    def from_utterances(cls, utterances: list[dict]) -> "TranscriptColumns":
+        speakers = []
+        codes = {}
+
+        def intern(name):
+            code = codes.get(name)
+            if code is None:
+                code = codes[name] = len(speakers)
+                speakers.append(name)
+            return code
+
+        word_texts = []
+        word_offsets = array("I", [0])
+        word_start = array("q")
+        word_end = array("q")
+        word_confidence = array("d")
+        word_speaker = array("H")
+        pos = 0
+        for u in utterances:
+            for w in u.get("words", []):
+                t = w.get("text", "")
+                word_texts.append(t)
+                pos += len(t)
+                word_offsets.append(pos)
+                word_start.append(w.get("start", 0))
+                word_end.append(w.get("end", 0))
+                word_confidence.append(w.get("confidence", 0))
+                word_speaker.append(intern(w.get("speaker")))
+        words = WordColumns(
+            "".join(word_texts),
+            word_offsets,
+            word_start,
+            word_end,
+            word_confidence,
+            word_speaker,
+        )
+        del word_texts
+
+        columns = cls(speakers, words)
+        texts = []
+        pos = 0
+        n_words = 0
+        for u in utterances:
+            t = u.get("text", "")
+            texts.append(t)
+            pos += len(t)
+            columns.text_offsets.append(pos)
+            columns.start.append(u.get("start", 0))
+            columns.end.append(u.get("end", 0))
+            columns.confidence.append(u.get("confidence", 0))
+            columns.speaker.append(intern(u.get("speaker", "")))
+            columns.word_bounds.append(n_words)
+            n_words += len(u.get("words", []))
+            columns.word_bounds.append(n_words)
+        columns.text = "".join(texts)
+        return columns
+
+    @classmethod
+    def from_response(cls, json_response: dict) -> "TranscriptColumns":
+        # 未开启说话人识别时没有 utterances，整份转录视为一条语句
+        utterances = json_response.get("utterances")
+        if not utterances and json_response.get("words"):
+            utterances = [json_response]
+        return cls.from_utterances(utterances or [])
+
+    def segment_text(self, i) -> str:
+        return self.text[self.text_offsets[i] : self.text_offsets[i + 1]]
+
+    def word_range(self, i) -> range:
+        return range(self.word_bounds[2 * i], self.word_bounds[2 * i + 1])
+
+    def word_dicts(self, lo, hi) -> list[dict]:
+        w = self.words
+        text, offsets, speakers = w.text, w.offsets, self.speakers
+        return [
+            {
+                "text": text[offsets[j] : offsets[j + 1]],
+                "start": start,
+                "end": end,
+                "confidence": confidence,
+                "speaker": speakers[speaker],
+            }
+            for j, start, end, confidence, speaker in zip(
+                range(lo, hi),
+                w.start[lo:hi],
+                w.end[lo:hi],
+                w.confidence[lo:hi],
+                w.speaker[lo:hi],
+            )
+        ]
+
+    def segment_dict(self, i) -> dict:
+        return {
+            "speaker": self.speakers[self.speaker[i]],
+            "text": self.segment_text(i),
+            "confidence": self.confidence[i],
+            "start": self.start[i],
+            "end": self.end[i],
+            "words": self.word_dicts(
+                self.word_bounds[2 * i], self.word_bounds[2 * i + 1]
+            ),
+        }
+
+    def to_dicts(self) -> list[dict]:
+        """还原为 AssemblyAI 风格的 dict 列表（接口响应使用）"""
+        return [self.segment_dict(i) for i in range(len(self))]
+
+    def segment_times(self, i, with_words=False):
+        """(说话人, 开始, 结束, 词的 (开始, 结束) 序列或 None)，供字幕时间分配使用，不构造词 dict"""
+        words = None
+        if with_words:
+            lo, hi = self.word_bounds[2 * i], self.word_bounds[2 * i + 1]
+            words = zip(self.words.start[lo:hi], self.words.end[lo:hi])
+        return self.speakers[self.speaker[i]], self.start[i], self.end[i], words
+
+    def to_checkpoint(self) -> dict:
+        """检查点使用的紧凑结构：各列原样保存为数组，词与片段文本各为一个字符串"""
+        w = self.words
+        return {
+            "speakers": self.speakers,
+            "words": {
+                "text": w.text,
+                "offsets": w.offsets.tolist(),
+                "start": w.start.tolist(),
+                "end": w.end.tolist(),
+                "confidence": w.confidence.tolist(),
+                "speaker": w.speaker.tolist(),
+            },
+            "text": self.text,
+            "text_offsets": self.text_offsets.tolist(),
+            "start": self.start.tolist(),
+            "end": self.end.tolist(),
+            "confidence": self.confidence.tolist(),
+            "speaker": self.speaker.tolist(),
+            "word_bounds": self.word_bounds.tolist(),
+        }
+
+    @classmethod
+    def from_checkpoint(cls, value) -> "TranscriptColumns":
+        # 旧版本的检查点为 dict 列表
+        if isinstance(value, list):
+            return cls.from_utterances(value)
+        w = value["words"]
+        words = WordColumns(
+            w["text"],
+            array("I", w["offsets"]),
+            array("q", w["start"]),
+            array("q", w["end"]),
+            array("d", w["confidence"]),
+            array("H", w["speaker"]),
+        )
+        columns = cls(value["speakers"], words)
+        columns.text = value["text"]
+        columns.text_offsets = array("I", value["text_offsets"])
+        columns.start = array("q", value["start"])
+        columns.end = array("q", value["end"])
+        columns.confidence = array("d", value["confidence"])
+        columns.speaker = array("H", value["speaker"])
+        columns.word_bounds = array("I", value["word_bounds"])
+        return columns
+
+    def nbytes(self) -> int:
+        w = self.words
+        arrays = (
+            w.offsets,
+            w.start,
+            w.end,
+            w.confidence,
+            w.speaker,
+            self.text_offsets,
+            self.start,
+            self.end,
+            self.confidence,
+            self.speaker,
+            self.word_bounds,
+        )
+        return (
+            sys.getsizeof(w.text)
+            + sys.getsizeof(self.text)
+            + sum(a.itemsize * len(a) for a in arrays)
+        )
+
+    def _append(self, text, start, end, confidence, speaker, lo, hi, texts):
+        texts.append(text)
+        self.text_offsets.append(self.text_offsets[-1] + len(text))
+        self.start.append(start)
+        self.end.append(end)
+        self.confidence.append(confidence)
+        self.speaker.append(speaker)
+        self.word_bounds.append(lo)
+        self.word_bounds.append(hi)
+
+    def split_sentences(self) -> "TranscriptColumns":
+        """按句末标点把每个片段拆成句子，并在一次线性扫描中把句子对齐到词区间
+
+        对齐在去掉标点、空白并统一小写后的字符上进行，句子文本与词文本在标点、空格、
+        大小写上的差异不影响结果；个别字符对不上时在小窗口内重新同步，不会放弃后续句子
+        """
+        sentences = TranscriptColumns(self.speakers, self.words)
+        texts = []
+        word_text = self.words.text
+        word_offsets = self.words.offsets
+        word_start = self.words.start
+        word_end = self.words.end
+        split = SENTENCE_PATTERN.split
+        for i in range(len(self)):
+            parts = split(self.text[self.text_offsets[i] : self.text_offsets[i + 1]])
+            raw = [
+                parts[k] + parts[k + 1]
+                for k in range(0, len(parts) - 1, 2)
+                if parts[k].strip()
+            ]
+            if parts[-1].strip():
+                raw.append(parts[-1])
+            raw = [r.strip() for r in raw]
+            if not raw:
+                continue
+
+            lo, hi = self.word_bounds[2 * i], self.word_bounds[2 * i + 1]
+            base = word_offsets[lo]
+            compact = ["".join(r.split()) for r in raw]
+            if "".join(compact) == word_text[base : word_offsets[hi]]:
+                # 常见情况：去掉空白后句子与词文本逐字一致，直接用词偏移
+                sentence_norm = compact
+                bounds = word_offsets[lo : hi + 1]
+                targets = ends = _cumulative(compact, base)
+            else:
+                # 归一化（去标点、空白，统一小写）后再对齐
+                sentence_norm = [normalize(r) for r in raw]
+                ends = _cumulative(sentence_norm, 0)
+                word_norm = [
+                    normalize(word_text[word_offsets[j] : word_offsets[j + 1]])
+                    for j in range(lo, hi)
+                ]
+                bounds = [0]
+                for w in word_norm:
+                    bounds.append(bounds[-1] + len(w))
+                a = "".join(sentence_norm)
+                b = "".join(word_norm)
+                targets = ends if a == b else align_positions(a, b, ends)
+                base = 0
+
+            seg_start, seg_end = self.start[i], self.end[i]
+            cursor = lo
+            prev_end = seg_start
+            for k, r in enumerate(raw):
+                first = cursor
+                # 词的中点落在句子范围内即归属该句
+                limit = 2 * targets[k]
+                while cursor < hi:
+                    j = cursor - lo
+                    if bounds[j] + bounds[j + 1] >= limit:
+                        break
+                    cursor += 1
+                if k == len(raw) - 1:
+                    cursor = hi  # 剩余的词归入最后一句
+                if cursor > first:
+                    start, end = word_start[first], word_end[cursor - 1]
+                elif hi == lo and ends[-1] > base:
+                    # 语句没有词级时间戳：按文本长度比例分配
+                    span = seg_end - seg_start
+                    total = ends[-1] - base
+                    before = ends[k] - base - len(sentence_norm[k])
+                    start = seg_start + span * before // total
+                    end = seg_start + span * (ends[k] - base) // total
+                else:
+                    start = end = prev_end
+                prev_end = end
+                sentences._append(
+                    r,
+                    start,
+                    end,
+                    self.confidence[i],
+                    self.speaker[i],
+                    first,
+                    cursor,
+                    texts,
+                )
+        sentences.text = "".join(texts)
+        return sentences
+
+
+def _cumulative(texts: list[str], base: int) -> list[int]:
+    result = []
+    pos = base
+    for t in texts:
+        pos += len(t)
+        result.append(pos)
+    return result
+
+
+def normalize(text: str) -> str:
+    return NON_WORD.sub("", text).lower()
+
+
+def align_positions(a: str, b: str, targets: list[int]) -> list[int]:
+    """把 a 中一组递增的位置映射到 b 上对应的位置
+
+    双指针顺序匹配；遇到不一致时在 RESYNC_WINDOW 内寻找最近的、后续 RESYNC_MATCH 个字符
+    都相同的位置重新同步（插入、删除、替换都能处理），找不到则按替换处理，整体线性
+    """
+    result = []
+    i = j = 0
+    nb = len(b)
+    for t in targets:
+        while i < t:
+            if j >= nb:
+                i = t
+                break
+            if a[i] == b[j]:
+                i += 1
+                j += 1
+                continue
+            di, dj = _resync(a, b, i, j)
+            i += di
+            j += dj
+        result.append(max(0, min(nb, j - (i - t))))
+    return result
+
+
+def _resync(a, b, i, j) -> tuple[int, int]:
+    na, nb = len(a), len(b)
+    for d in range(1, RESYNC_WINDOW):
+        for di in range(d + 1):
+            dj = d - di
+            x, y = i + di, j + dj
+            if x > na or y > nb:
+                continue
+            k = min(RESYNC_MATCH, na - x, nb - y)
+            if k == 0:
+                if x == na and y == nb:
+                    return di, dj
+                continue
+            if a[x : x + k] == b[y : y + k]:
+                return di, dj
+    return 1, 1
@@ -2,44 +2,77 @@ import ffmpeg
 from utils import download_file, create_tempdir
 import os
 from subtitle import SubtitleCreator
-from utils import modify_separator, SubtitleData
+from utils import modify_separator, Cue
+from metrics import stage, STAGE_BYTES, INFLIGHT_ENCODES
 
 
 class SubtitleEmbed:
-    def __init__(self, video_path, data: list[SubtitleData]):
+    def __init__(self, video_path, data: list[Cue], temp_dir=None):
         self.video_path = video_path
         self.data = data
+        self.temp_dir = temp_dir
 
-    def embed(self):
-        # 创建临时目录并生成字幕文件
-        temp_dir = create_tempdir()
-        subtitle_path = os.path.join(temp_dir, "styled_subtitles.ssa")
-        output_path = os.path.join(temp_dir, "output.mp4")
+    def prepare(self) -> str:
+        """下载视频（如需要）并生成字幕文件，返回字幕文件路径"""
+        # 创建临时目录并生成字幕文件（未指定任务目录时单独分配）
+        if self.temp_dir is None:
+            self.temp_dir = create_tempdir()
+        subtitle_path = os.path.join(self.temp_dir, "styled_subtitles.ssa")
         # 如果是URL则下载
         if self.video_path.startswith("http"):
-            self.video_path = download_file(self.video_path, temp_dir)
+            self.video_path = download_file(self.video_path, self.temp_dir)
 
         # 生成字幕文件
         subtitle_creator = SubtitleCreator(
             data=self.data, video_path=self.video_path, output_path=subtitle_path
         )
-        subtitle_path = subtitle_creator.create_ssa()
+        with stage("ssa"):
+            subtitle_path = subtitle_creator.create_ssa()
         self.data = subtitle_creator.data
+        self.video_width = subtitle_creator.video_width
+        self.video_height = subtitle_creator.video_height
+        self.font_size = subtitle_creator.font_size
+        self.styles = subtitle_creator.styles
+        return subtitle_path
 
+    def encode(self, subtitle_path) -> str:
+        """将字幕文件烧录进视频，返回输出视频路径"""
+        output_path = os.path.join(self.temp_dir, "output.mp4")
         print("开始处理...")
 
         # 嵌入字幕
         subtitle_path = modify_separator(subtitle_path)
-        ffmpeg.input(self.video_path).output(
-            output_path,
-            vf=f"ass={subtitle_path},scale={subtitle_creator.video_width}:{subtitle_creator.video_height}",  # 使用ass滤镜添加字幕
-            vcodec="libx264",  # 重新编码视频以嵌入字幕
-            acodec="aac",
-        ).run(overwrite_output=True)
+        with INFLIGHT_ENCODES.track_inprogress(), stage("encode"):
+            ffmpeg.input(self.video_path).output(
+                output_path,
+                vf=f"ass={subtitle_path},scale={self.video_width}:{self.video_height}",  # 使用ass滤镜添加字幕
+                vcodec="libx264",  # 重新编码视频以嵌入字幕
+                acodec="aac",
+            ).run(overwrite_output=True)
+        STAGE_BYTES.observe(os.path.getsize(output_path), stage="encode_output")
 
         print(f"完成！输出文件: {output_path}")
         return output_path
 
+    def encode_segment(self, subtitle_path, output_path, start, duration) -> str:
+        """只编码 [start, start + duration)（秒）的画面，不含音轨；编码参数与 encode 一致以便拼接
+
+        字幕文件的时间需已平移为相对 start
+        """
+        subtitle_path = modify_separator(subtitle_path)
+        with INFLIGHT_ENCODES.track_inprogress(), stage("encode_segment"):
+            ffmpeg.input(self.video_path, ss=start, t=duration).output(
+                output_path,
+                vf=f"ass={subtitle_path},scale={self.video_width}:{self.video_height}",
+                vcodec="libx264",
+                an=None,
+            ).run(overwrite_output=True, quiet=True)
+        return output_path
+
+    def embed(self):
+        subtitle_path = self.prepare()
+        return self.encode(subtitle_path)
+
 
 if __name__ == "__main__":
     # video_path = (
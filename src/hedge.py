@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import counter
+
+# LLM 请求对冲：调用超过该操作近期延迟的 p95 仍未返回时，再发一个相同请求（可指向备用服务 / 模型），
+# 先返回有效结果的一方胜出；对冲请求数不超过总调用数的 LLM_HEDGE_BUDGET 比例，控制额外花费
+# 延迟样本由调用方按单次请求记录（见 upstream.call 的 observe），不含限流排队与重试退避，
+# 上游限流 / 出错期间 p95 不会被拉高而失去对冲；对冲计时同样从 primary 取得并发名额时开始
+# （upstream.call 的 on_slot），在限流队列中等待的调用不会被误判为慢请求
+
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+HEDGE_QUANTILE = 0.95
+# 每个操作保留的延迟样本数；样本不足时不对冲
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+# 预算之外允许的少量突发
+BUDGET_BURST = 2
+
+HEDGES = counter("videotingyi_llm_hedges", "发出的对冲请求数", ["op"])
+HEDGE_WINS = counter(
+    "videotingyi_llm_hedge_wins", "对冲后胜出的一方（primary / hedge）", ["op", "winner"]
+)
+HEDGE_SKIPPED = counter(
+    "videotingyi_llm_hedges_skipped", "因超出预算未发出的对冲请求数", ["op"]
+)
+
+
+class _SlotClock:
+    """记录 primary 最近一次取得并发名额的时间，primary 完成时唤醒等待方"""
+
+    def __init__(self):
+        self.started = None
+        self.cond = threading.Condition()
+
+    def start(self):
+        with self.cond:
+            self.started = time.monotonic()
+            self.cond.notify_all()
+
+    def notify(self, _=None):
+        with self.cond:
+            self.cond.notify_all()
+
+
+class Hedger:
+    def __init__(self, budget=HEDGE_BUDGET, max_workers=32):
+        self.budget = budget
+        self._latencies = {}
+        self._calls = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="llm-hedge"
+        )
+
+    def delay(self, op: str) -> float | None:
+        """该操作延迟的 p95（秒），样本不足时返回 None"""
+        with self._lock:
+            samples = self._latencies.get(op)
+            if samples is None or len(samples) < MIN_SAMPLES:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_QUANTILE))]
+
+    def record(self, op: str, latency: float):
+        with self._lock:
+            samples = self._latencies.get(op)
+            if samples is None:
+                samples = self._latencies[op] = deque(maxlen=LATENCY_WINDOW)
+            samples.append(latency)
+
+    def _allow(self) -> bool:
+        with self._lock:
+            if self._hedges + 1 > self._calls * self.budget + BUDGET_BURST:
+                return False
+            self._hedges += 1
+            return True
+
+    def _overdue(self, first, clock: _SlotClock, delay: float) -> bool:
+        """primary 取得并发名额后超过 delay 仍未完成时返回 True，先完成时返回 False"""
+        with clock.cond:
+            while not first.done():
+                if clock.started is None:
+                    # 仍在限流队列中等待，不计时
+                    clock.cond.wait()
+                    continue
+                remaining = clock.started + delay - time.monotonic()
+                if remaining <= 0:
+                    return True
+                clock.cond.wait(remaining)
+        return False
+
+    def run(self, op: str, primary, secondary, valid):
+        """执行 primary(on_slot)，取得并发名额后超过 p95 未返回时对冲执行 secondary()，
+        返回先通过 valid 校验的结果
+
+        primary 应把 on_slot 传给 upstream.call；两者都失败或无效时，返回 primary 的结果
+        （或抛出其异常）；两者都应通过 record 记录单次请求耗时
+        """
+        with self._lock:
+            self._calls += 1
+        delay = self.delay(op)
+        clock = _SlotClock()
+        first = self._executor.submit(primary, clock.start)
+        if delay is None:
+            return first.result()
+        first.add_done_callback(clock.notify)
+        if not self._overdue(first, clock, delay):
+            return first.result()
+        if not self._allow():
+            HEDGE_SKIPPED.inc(op=op)
+            return first.result()
+
+        HEDGES.inc(op=op)
+        second = self._executor.submit(secondary)
+        names = {first: "primary", second: "hedge"}
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and valid(future.result()):
+                    HEDGE_WINS.inc(op=op, winner=names[future])
+                    return future.result()
+        # 落败一方的请求无法中途取消，会在后台自然结束
+        return first.result()
+
+
+_hedger = None
+_hedger_lock = threading.Lock()
+
+
+def get_hedger() -> Hedger | None:
+    """未开启对冲时返回 None"""
+    global _hedger
+    if not LLM_HEDGE:
+        return None
+    with _hedger_lock:
+        if _hedger is None:
+            _hedger = Hedger()
+        return _hedger
@@ -0,0 +1,211 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class JobFailedError(RuntimeError):
+    """worker 执行失败，error_info 为 worker 写回的错误详情"""
+
+    def __init__(self, error_info: dict):
+        super().__init__((error_info or {}).get("error_message", "任务执行失败"))
+        self.error_info = error_info
+
+
+# 持久化任务队列（SQLite WAL）：API 进程入队，worker 进程抢占执行并写回结果
+# 状态流转：queued -> running -> succeeded / failed；worker 失联（租约过期）后任务重新入队
+class JobQueue:
+    def __init__(self, path: str, lease_seconds: float = 120, max_attempts: int = 2):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT NOT NULL, "
+            "result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "worker TEXT, lease_until REAL, created_at REAL, updated_at REAL, "
+            "dedupe_key TEXT)"
+        )
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+        if "dedupe_key" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN dedupe_key TEXT")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_dedupe ON jobs(dedupe_key, status)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(
+        self, payload: dict, job_id: str = None, dedupe_key: str = None
+    ) -> tuple[str, bool]:
+        """
+        入队一个任务；若已有相同 dedupe_key 的任务在排队或执行中，则直接复用该任务
+
+        Returns:
+            (job_id, 是否新建)
+        """
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if dedupe_key is not None:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE dedupe_key = ? "
+                    "AND status IN ('queued', 'running') LIMIT 1",
+                    (dedupe_key,),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("COMMIT")
+                    return row["id"], False
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, created_at, updated_at, "
+                "dedupe_key) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(payload, ensure_ascii=False), now, now, dedupe_key),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return job_id, True
+
+    def claim(self, worker_id: str) -> dict | None:
+        """抢占一个待执行任务（含租约过期的运行中任务），没有则返回 None"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' "
+                "OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            if row["status"] == "running" and row["attempts"] >= self.max_attempts:
+                # 多次执行都未能完成（worker 崩溃），不再重试
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (json.dumps({"error_message": "worker 多次失联"}), now, row["id"]),
+                )
+                conn.execute("COMMIT")
+                return self.claim(worker_id)
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker_id, now + self.lease_seconds, now, row["id"]),
+            )
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        # 返回更新后的行（status / worker / attempts / lease_until 均为本次抢占写入的值）
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def heartbeat(self, job_id: str, worker_id: str):
+        self._conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? "
+            "AND status = 'running'",
+            (time.time() + self.lease_seconds, job_id, worker_id),
+        )
+
+    def complete(self, job_id: str, worker_id: str, result: dict) -> bool:
+        """写回结果；租约已过期且任务被其他 worker 重新领取时不写入，返回 False"""
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = 'succeeded', result = ?, updated_at = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (json.dumps(result, ensure_ascii=False), time.time(), job_id, worker_id),
+        )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id: str, worker_id: str, error: dict, attempts: int) -> bool:
+        """写回错误，未达到最大尝试次数时重新入队；已失去租约时不写入，返回 False"""
+        status = "queued" if attempts < self.max_attempts else "failed"
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+            "WHERE id = ? AND worker = ? AND status = 'running'",
+            (
+                status,
+                json.dumps(error, ensure_ascii=False),
+                time.time(),
+                job_id,
+                worker_id,
+            ),
+        )
+        return cursor.rowcount > 0
+
+    def update_result(self, job_id: str, result: dict) -> bool:
+        """替换已成功任务的结果（如修改字幕后），任务不存在或未成功时返回 False"""
+        cursor = self._conn().execute(
+            "UPDATE jobs SET result = ?, updated_at = ? "
+            "WHERE id = ? AND status = 'succeeded'",
+            (json.dumps(result, ensure_ascii=False), time.time(), job_id),
+        )
+        return cursor.rowcount > 0
+
+    def retry(self, job_id: str) -> bool:
+        """将失败的任务重新入队（从检查点继续），任务不存在或未失败时返回 False"""
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = 'queued', attempts = 0, error = NULL, "
+            "updated_at = ? WHERE id = ? AND status = 'failed'",
+            (time.time(), job_id),
+        )
+        return cursor.rowcount > 0
+
+    def get(self, job_id: str) -> dict | None:
+        row = self._conn().execute(
+            "SELECT * FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for field in ("payload", "result", "error"):
+            if job[field] is not None:
+                job[field] = json.loads(job[field])
+        return job
+
+    def depth(self) -> int:
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued'"
+        ).fetchone()
+        return row[0]
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(
+                os.getenv("JOB_QUEUE_DB", os.path.join(".", "data", "jobs.db")),
+                lease_seconds=float(os.getenv("JOB_LEASE_SECONDS", "120")),
+                max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "2")),
+            )
+        return _job_queue
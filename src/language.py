@@ -0,0 +1,47 @@
+import os
+
+# 源语言检测：优先使用 ASR 返回的 language_code（需开启 language_detection），
+# 否则按转录开头一段文本中汉字所占比例判断；与目标语言相同时跳过翻译
+
+TARGET_LANGUAGE = "zh"
+# 设为具体语言（如 en、zh）时不再检测，直接视为该语言
+SOURCE_LANGUAGE = os.getenv("SOURCE_LANGUAGE", "auto")
+# 只看开头这么多字符，相当于音频的前几十秒
+SAMPLE_CHARS = 2000
+CJK_THRESHOLD = 0.5
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF
+        or 0x3400 <= code <= 0x4DBF
+        or 0xF900 <= code <= 0xFAFF
+        or 0x20000 <= code <= 0x2FA1F
+    )
+
+
+def cjk_ratio(text: str) -> float:
+    """字母类字符中汉字的比例（不计标点、数字与空白）"""
+    letters = [ch for ch in text if ch.isalpha()]
+    if not letters:
+        return 0.0
+    return sum(1 for ch in letters if _is_cjk(ch)) / len(letters)
+
+
+def detect_language(json_response: dict) -> str:
+    """返回源语言代码的主标签（如 en、zh）"""
+    if SOURCE_LANGUAGE != "auto":
+        return SOURCE_LANGUAGE
+    code = (json_response.get("language_code") or "").lower().split("_")[0]
+    if json_response.get("language_detection") and code:
+        return code
+    # 未开启语言检测时 language_code 固定为默认的 en_us，不可信
+    text = (json_response.get("text") or "")[:SAMPLE_CHARS]
+    if cjk_ratio(text) >= CJK_THRESHOLD:
+        return "zh"
+    return code or "en"
+
+
+def needs_translation(language: str) -> bool:
+    return language != TARGET_LANGUAGE
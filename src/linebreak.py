@@ -0,0 +1,288 @@
+import math
+import os
+import unicodedata
+from functools import lru_cache
+
+# 按显示宽度断行：字宽优先取自字体文件（需安装 fontTools 并配置 SUBTITLE_FONT_PATH），
+# 否则按 Unicode East Asian Width 估算（全角 1em，半角约 0.55em，组合字符 0）
+# 字幕断行（SubtitleCreator）与 LLM 拆分长度、本地停顿拆分共用这里的宽度计算
+
+try:
+    from fontTools.ttLib import TTFont
+except ImportError:  # 可选依赖
+    TTFont = None
+
+FONT_PATH = os.getenv("SUBTITLE_FONT_PATH", "")
+# Dialogue 行左右各 10 像素边距
+LINE_MARGIN = 20
+HALF_WIDTH_EM = 0.55
+PAUSE_PUNCTUATION = set("，；：。、,;: ")
+NORMAL_PUNCTUATION = "?？!！"
+# 不能出现在行首 / 行尾的标点
+NO_BREAK_BEFORE = set("，。、；：？！,.;:?!)]}）》」』】〕”’…—")
+NO_BREAK_AFTER = set("([{（《「『【〔“‘")
+
+
+class FontMetrics:
+    """某个字体在某个字号下的字宽（像素），逐字符缓存"""
+
+    def __init__(self, font_size: int, advances: dict = None, ambiguous_wide=True):
+        self.font_size = font_size
+        # 码点 -> 字宽（em），来自字体文件的 hmtx 表
+        self.advances = advances or {}
+        # 中文字体中“”…等 East Asian Ambiguous 字符按全角显示
+        self.ambiguous_wide = ambiguous_wide
+        self._cache = {}
+
+    def char_width(self, ch: str) -> float:
+        width = self._cache.get(ch)
+        if width is None:
+            em = self.advances.get(ord(ch))
+            if em is None:
+                em = _eaw_em(ch, self.ambiguous_wide)
+            width = self._cache[ch] = em * self.font_size
+        return width
+
+    def width(self, text: str) -> float:
+        char_width = self.char_width
+        return sum(char_width(ch) for ch in text)
+
+
+def _eaw_em(ch: str, ambiguous_wide: bool) -> float:
+    if unicodedata.combining(ch) or unicodedata.category(ch) in ("Mn", "Me", "Cf"):
+        return 0.0
+    eaw = unicodedata.east_asian_width(ch)
+    if eaw in ("W", "F") or (eaw == "A" and ambiguous_wide):
+        return 1.0
+    return HALF_WIDTH_EM
+
+
+def _load_advances(font_path: str) -> dict:
+    font = TTFont(font_path, lazy=True)
+    units_per_em = font["head"].unitsPerEm
+    metrics = font["hmtx"].metrics
+    return {
+        code: metrics[glyph][0] / units_per_em
+        for code, glyph in font.getBestCmap().items()
+        if glyph in metrics
+    }
+
+
+@lru_cache(maxsize=8)
+def _font_advances(font_path: str) -> dict:
+    if not font_path or TTFont is None or not os.path.exists(font_path):
+        return {}
+    try:
+        return _load_advances(font_path)
+    except Exception as e:
+        print(f"读取字体度量失败，按 East Asian Width 估算: {e}")
+        return {}
+
+
+@lru_cache(maxsize=32)
+def get_metrics(font_size: int, font_path: str = FONT_PATH) -> FontMetrics:
+    """每种字体 / 字号只加载一次"""
+    return FontMetrics(font_size, _font_advances(font_path))
+
+
+def line_width(video_width: int) -> int:
+    """一行字幕可用的像素宽度"""
+    return max(1, video_width - LINE_MARGIN)
+
+
+def line_capacity(video_width: int, metrics: FontMetrics) -> int:
+    """一行能容纳的全角字符数（给按字数拆分的 LLM 提示词用）"""
+    return max(1, int(line_width(video_width) // metrics.char_width("中")))
+
+
+def split_at_pauses(text: str, limit: float, char_width=None) -> list[str]:
+    """按停顿符号与宽度上限分块，停顿符号本身被删除
+
+    char_width 为 None 时每个字符宽度记为 1（即按字数），否则为 字符 -> 宽度 的函数；
+    英文句点仅在不是小数点时视为停顿，问号、感叹号在块已满时仍可附在块尾
+    """
+    if limit <= 0:
+        return []
+    chunks = []
+    current = []
+    current_width = 0
+    n = len(text)
+    for i, char in enumerate(text):
+        if char in PAUSE_PUNCTUATION:
+            is_pause = True
+        elif char == ".":
+            # 前后均为数字时是小数点，不是停顿
+            is_pause = not (
+                i > 0 and text[i - 1].isdigit() and i + 1 < n and text[i + 1].isdigit()
+            )
+        else:
+            is_pause = False
+
+        if is_pause:
+            if current:
+                chunks.append("".join(current))
+                current = []
+                current_width = 0
+            continue
+
+        w = 1 if char_width is None else char_width(char)
+        if current and current_width + w > limit:
+            if char in NORMAL_PUNCTUATION:
+                current.append(char)
+                chunks.append("".join(current))
+                current = []
+                current_width = 0
+                continue
+            chunks.append("".join(current))
+            current = []
+            current_width = 0
+        current.append(char)
+        current_width += w
+
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def _is_wide(ch: str) -> bool:
+    return unicodedata.east_asian_width(ch) in ("W", "F")
+
+
+class _Atom:
+    """不可再断开的最小单元：一个全角字符或一个半角单词（连同粘连的避头尾标点）"""
+
+    __slots__ = ("text", "width", "space")
+
+    def __init__(self, text, width, space):
+        self.text = text
+        self.width = width
+        self.space = space  # 与前一个单元之间有空格
+
+
+def _atoms(text: str, max_width: float, metrics: FontMetrics) -> list[_Atom]:
+    atoms = []
+    space = False
+    for ch in text:
+        if ch == " ":
+            space = bool(atoms)
+            continue
+        w = metrics.char_width(ch)
+        last = atoms[-1] if atoms else None
+        if (
+            last is not None
+            and not space
+            and last.width + w <= max_width
+            and (
+                ch in NO_BREAK_BEFORE
+                or last.text[-1] in NO_BREAK_AFTER
+                or not (_is_wide(ch) or _is_wide(last.text[-1]))
+            )
+        ):
+            last.text += ch
+            last.width += w
+        else:
+            atoms.append(_Atom(ch, w, space))
+        space = False
+    return atoms
+
+
+def _render(atoms: list[_Atom]) -> str:
+    return "".join(
+        (" " if a.space and i else "") + a.text for i, a in enumerate(atoms)
+    )
+
+
+def balance_two_lines(atoms: list[_Atom], max_width: float, sep_width: float) -> int | None:
+    """一次扫描所有断点，返回两行都不超宽且较长一行最短的断点（第一行的单元数）
+
+    有放得下的短语边界（空格，即原停顿处）时只在短语边界中选，都放不下时才在短语内部断开
+    """
+    total = sum(a.width for a in atoms)
+    total += sep_width * sum(1 for a in atoms[1:] if a.space)
+    best = None
+    best_cost = None
+    first = 0.0
+    for k in range(1, len(atoms)):
+        prev = atoms[k - 1]
+        first += prev.width + (sep_width if prev.space and k > 1 else 0)
+        gap = sep_width if atoms[k].space else 0
+        second = total - first - gap
+        if first > max_width or second > max_width:
+            continue
+        # 短语边界优先；其次较长行越短越好；相同时上短下长（字幕惯例的"正三角"）
+        cost = (not atoms[k].space, max(first, second), first > second)
+        if best_cost is None or cost < best_cost:
+            best, best_cost = k, cost
+    return best
+
+
+def _phrases(atoms: list[_Atom]) -> list[list[_Atom]]:
+    """按空格（原停顿处）把单元分成短语"""
+    phrases = []
+    for a in atoms:
+        if a.space or not phrases:
+            phrases.append([a])
+        else:
+            phrases[-1].append(a)
+    return phrases
+
+
+def layout(text: str, max_width: float, metrics: FontMetrics) -> list[list[str]]:
+    """把一条字幕排成若干屏，每屏 1~2 行
+
+    放不下一行时把停顿标点换成空格（与拆分步骤的规则相同），以停顿之间的短语为单位贪心装行，
+    短语比一行还宽时才在其内部断开；每两行一屏，每屏内再选择最均衡的断点。
+    全角字符之间、空格处可断，半角单词不断开
+    """
+    if metrics.width(text) <= max_width:
+        return [[text]]
+    display = " ".join(split_at_pauses(text, float("inf")))
+    atoms = _atoms(display, max_width, metrics)
+    if not atoms:
+        return [[text]]
+    sep_width = metrics.char_width(" ")
+
+    lines = []
+    line = []
+    width = 0.0
+    for phrase in _phrases(atoms):
+        gap = sep_width if line else 0
+        phrase_width = sum(a.width for a in phrase)
+        if line and width + gap + phrase_width <= max_width:
+            line += phrase
+            width += gap + phrase_width
+            continue
+        if line:
+            lines.append(line)
+            line = []
+            width = 0.0
+        if phrase_width <= max_width:
+            line = list(phrase)
+            width = phrase_width
+            continue
+        # 单个短语比一行还宽时才在短语内部按单元断开，各段宽度尽量均匀
+        target = phrase_width / math.ceil(phrase_width / max_width)
+        boundary = target
+        placed = 0.0
+        for a in phrase:
+            if line and (
+                width + a.width > max_width or placed + a.width / 2 > boundary
+            ):
+                lines.append(line)
+                line = []
+                width = 0.0
+                boundary = placed + target
+            line.append(a)
+            width += a.width
+            placed += a.width
+    lines.append(line)
+
+    screens = []
+    for i in range(0, len(lines), 2):
+        if i + 1 == len(lines):
+            screens.append([_render(lines[i])])
+            continue
+        pair = lines[i] + lines[i + 1]
+        k = balance_two_lines(pair, max_width, sep_width) or len(lines[i])
+        screens.append([_render(pair[:k]), _render(pair[k:])])
+    return screens
@@ -0,0 +1,231 @@
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from jinja2 import Template
+
+from metrics import counter, histogram
+
+# 跨任务的 LLM 批处理：并发任务提交的翻译 / 拆分请求先在窗口期内攒一批，
+# 按 token 预算打包成一个带 id 的 JSON 数组提示词，结果按 id 分发回各请求；
+# 某个 id 缺失或整批失败时，该请求退回单独调用，不影响同批其他请求
+# 每个请求自带发送用的 chat 与提交时的 contextvars（trace），调度器本身不持有任何任务的对象
+
+LLM_BATCH = os.getenv("LLM_BATCH", "0") == "1"
+# 攒批窗口：收到第一个请求后最多等待的时间
+BATCH_WINDOW = float(os.getenv("LLM_BATCH_WINDOW_MS", "300")) / 1000
+# 单批输入的 token 预算（估算值）
+BATCH_TOKENS = int(os.getenv("LLM_BATCH_TOKENS", "3000"))
+# 同时在途的批请求数
+BATCH_CONCURRENCY = int(os.getenv("LLM_BATCH_CONCURRENCY", "4"))
+
+BATCH_ITEMS = histogram(
+    "videotingyi_llm_batch_items",
+    "每个批请求合并的请求数",
+    ["kind"],
+    (1, 2, 4, 8, 16, 32, 64, 128),
+)
+BATCH_FALLBACKS = counter(
+    "videotingyi_llm_batch_fallbacks", "批结果缺失而退回单独调用的请求数", ["kind"]
+)
+
+
+def estimate_tokens(value) -> int:
+    # 粗略估算：中文约 1 token / 字，英文约 4 字节 / token，按 UTF-8 字节数 / 3 折中
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8")) // 3 + 1
+
+
+def load_config(name: str) -> dict:
+    path = Path(__file__).parent.resolve() / "config" / name
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class _Request:
+    __slots__ = (
+        "kind",
+        "key",
+        "payload",
+        "single",
+        "chat",
+        "group",
+        "context",
+        "tokens",
+        "future",
+    )
+
+    def __init__(self, kind, key, payload, single, chat, group):
+        self.kind = kind
+        self.key = key  # 提示词参数相同的请求才能合并（如拆分的最大长度）
+        self.payload = payload
+        self.single = single  # 退回单独调用时执行
+        self.chat = chat  # chat(messages, op) -> str
+        self.group = group  # 上游配置（服务地址、模型）相同的请求才能合并
+        self.context = contextvars.copy_context()
+        self.tokens = estimate_tokens(payload)
+        self.future = Future()
+
+    def run(self, fn, *args, **kwargs):
+        # 在提交请求时的上下文中执行，span 归属于提交请求的任务；同一上下文不能同时进入两次，每次复制
+        return self.context.copy().run(fn, *args, **kwargs)
+
+
+class BatchKind:
+    """一类可合并的请求：如何构造批提示词、如何从批结果中取出某个 id 的结果"""
+
+    def __init__(self, config_name, item_field, result_field, validate):
+        self.config = load_config(config_name)
+        self.item_field = item_field
+        self.result_field = result_field
+        self.validate = validate
+
+    def messages(self, key, items: list[dict]) -> list[dict]:
+        params = {"items": json.dumps(items, ensure_ascii=False), "max_length": key}
+        return [
+            {"role": "system", "content": Template(self.config["sp"]).render(**params)},
+            {"role": "user", "content": Template(self.config["up"]).render(**params)},
+        ]
+
+    def results(self, content: str) -> dict:
+        """批结果 id -> 结果；无法解析时返回空 dict（全部退回单独调用）"""
+        try:
+            parsed = json.loads(content)
+        except (TypeError, ValueError):
+            return {}
+        if not isinstance(parsed, list):
+            return {}
+        results = {}
+        for entry in parsed:
+            if isinstance(entry, dict) and isinstance(entry.get("id"), int):
+                results[entry["id"]] = entry.get(self.result_field)
+        return results
+
+
+def _valid_split(request, value) -> bool:
+    return isinstance(value, list) and all(isinstance(s, str) for s in value)
+
+
+def _valid_translation(request, value) -> bool:
+    return (
+        isinstance(value, list)
+        and len(value) == len(request.payload)
+        and all(isinstance(v, dict) and isinstance(v.get("text"), str) for v in value)
+    )
+
+
+KINDS = {
+    "split": lambda: BatchKind(
+        "batch_split_llm_cfg.json", "text", "split_sentences", _valid_split
+    ),
+    "translate": lambda: BatchKind(
+        "batch_translate_llm_cfg.json", "texts", "texts", _valid_translation
+    ),
+}
+
+
+class BatchScheduler:
+    def __init__(self, window=BATCH_WINDOW, token_budget=BATCH_TOKENS):
+        self.window = window
+        self.token_budget = token_budget
+        self.kinds = {name: factory() for name, factory in KINDS.items()}
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=BATCH_CONCURRENCY, thread_name_prefix="llm-batch"
+        )
+        threading.Thread(target=self._collect_loop, name="llm-batcher", daemon=True).start()
+
+    def submit(self, kind: str, key, payload, single, chat, group=None) -> Future:
+        request = _Request(kind, key, payload, single, chat, group)
+        self._queue.put(request)
+        return request.future
+
+    def _collect_loop(self):
+        while True:
+            pending = [self._queue.get()]
+            tokens = pending[0].tokens
+            deadline = time.monotonic() + self.window
+            # 窗口期内持续收集，攒够预算的若干倍（可拆成多批并发发送）时提前结束
+            while tokens < self.token_budget * BATCH_CONCURRENCY:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                pending.append(request)
+                tokens += request.tokens
+            for batch in self._pack(pending):
+                self._executor.submit(batch[0].run, self._dispatch, batch)
+
+    def _pack(self, pending: list[_Request]) -> list[list[_Request]]:
+        groups = {}
+        for request in pending:
+            groups.setdefault(
+                (request.kind, request.key, request.group), []
+            ).append(request)
+        batches = []
+        for requests in groups.values():
+            batch = []
+            tokens = 0
+            for request in requests:
+                if batch and tokens + request.tokens > self.token_budget:
+                    batches.append(batch)
+                    batch = []
+                    tokens = 0
+                batch.append(request)
+                tokens += request.tokens
+            batches.append(batch)
+        return batches
+
+    def _dispatch(self, batch: list[_Request]):
+        kind = self.kinds[batch[0].kind]
+        results = {}
+        if len(batch) > 1:
+            BATCH_ITEMS.observe(len(batch), kind=batch[0].kind)
+            items = [
+                {"id": i, kind.item_field: request.payload}
+                for i, request in enumerate(batch)
+            ]
+            try:
+                # 同组请求的上游配置相同，用任一请求的 chat 发送
+                content = batch[0].chat(
+                    kind.messages(batch[0].key, items), op=f"{batch[0].kind}_batch"
+                )
+                results = kind.results(content)
+            except Exception as e:
+                print(f"批请求失败，退回单独调用: {e}")
+        for i, request in enumerate(batch):
+            value = results.get(i)
+            if kind.validate(request, value):
+                request.future.set_result(value)
+                continue
+            if len(batch) > 1:
+                BATCH_FALLBACKS.inc(kind=request.kind)
+            # 退回的单独调用重新提交到线程池并发执行，不占住当前批的线程
+            self._executor.submit(request.run, self._fallback, request)
+
+    @staticmethod
+    def _fallback(request: _Request):
+        try:
+            request.future.set_result(request.single())
+        except Exception as e:
+            request.future.set_exception(e)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_batch_scheduler() -> BatchScheduler:
+    """进程内共享同一个调度器"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = BatchScheduler()
+        return _scheduler
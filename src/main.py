@@ -1,25 +1,91 @@
 from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Form, Depends
+from fastapi.responses import Response, FileResponse
 import traceback
 import os
-import tempfile
-import shutil
-from datetime import date
-from collections import defaultdict
-from typing import Set, Optional
+import hashlib
+import math
+import time
+import asyncio
+import threading
+import anyio.to_thread
+from typing import Optional
+from pydantic import BaseModel, TypeAdapter
 from starlette.concurrency import run_in_threadpool
 
-# 假设这些模块不变
-from trans import Transcriber, OpenaiTranslator
-from utils import split_sentence_by_dot, generate_subtitle_data
-from embed import SubtitleEmbed
+from pipeline import run_pipeline, MODES, SUBTITLE_FORMATS
+from jobqueue import get_job_queue, JobFailedError
+from worker import Worker
+from workspace import get_workspace
+from checkpoint import CheckpointStore
+from singleflight import SingleFlight, job_key, source_identity
+from utils import SubtitleData
+import metrics
+from tracing import load_trace
+from render import FORMATS, MEDIA_TYPES, SubtitleDocument, cached_render, render
+from patch import patch_subtitles
+from ratelimit import create_rate_limiter
 from dotenv import load_dotenv
 
 load_dotenv()
 
 app = FastAPI(title="音频转录与字幕嵌入API")
 
-# ====== IP 限流（每天每个 IP 一次）======
-daily_ip_requests: defaultdict[date, Set[str]] = defaultdict(set)
+
+@app.on_event("startup")
+async def start_workspace_sweeper():
+    get_workspace().start_sweeper()
+
+
+@app.on_event("shutdown")
+async def stop_workspace_sweeper():
+    get_workspace().stop_sweeper()
+
+
+@app.get("/workspace/stats")
+async def workspace_stats():
+    return await run_in_threadpool(get_workspace().stats)
+
+
+metrics.gauge(
+    "videotingyi_workspace_bytes",
+    "临时工作目录占用字节数",
+    callback=lambda: get_workspace().stats()["bytes_in_use"],
+)
+metrics.gauge(
+    "videotingyi_job_queue_depth",
+    "任务队列中等待执行的任务数",
+    callback=lambda: get_job_queue().depth(),
+)
+
+
+THREADPOOL_BUSY = metrics.gauge(
+    "videotingyi_threadpool_busy", "线程池中正在执行的同步任务数"
+)
+THREADPOOL_SIZE = metrics.gauge("videotingyi_threadpool_size", "线程池容量")
+
+
+@app.on_event("startup")
+async def start_threadpool_sampler():
+    # 线程池限流器只能在事件循环中访问，定时采样到 gauge
+    limiter = anyio.to_thread.current_default_thread_limiter()
+
+    async def sample():
+        while True:
+            THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+            THREADPOOL_SIZE.set(limiter.total_tokens)
+            await asyncio.sleep(1)
+
+    app.state.threadpool_sampler = asyncio.get_running_loop().create_task(sample())
+
+
+@app.get("/metrics")
+async def metrics_api():
+    body = await run_in_threadpool(metrics.REGISTRY.render)
+    return Response(content=body, media_type=metrics.CONTENT_TYPE)
+
+
+# ====== IP 限流（默认每个 IP 每 24 小时一次，多 worker 共享 SQLite 状态）======
+ip_rate_limiter = create_rate_limiter("transcribe")
 
 
 def get_client_ip(request: Request) -> str:
@@ -33,10 +99,133 @@ def get_client_ip(request: Request) -> str:
 
 async def rate_limit_by_ip(request: Request):
     client_ip = get_client_ip(request)
-    today = date.today()
-    if client_ip in daily_ip_requests[today]:
-        raise HTTPException(status_code=429, detail="每个 IP 每天只能请求一次该接口。")
-    daily_ip_requests[today].add(client_ip)
+    allowed, retry_after = await run_in_threadpool(ip_rate_limiter.hit, client_ip)
+    if not allowed:
+        raise HTTPException(
+            status_code=429,
+            detail="该 IP 请求过于频繁，请稍后再试。",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+
+# ====== 部署模式 ======
+# single: API 进程内直接执行流程（并启动一个内置 worker 线程处理 /jobs 任务）
+# queue:  API 进程只负责入队，由独立的 worker 进程（src/worker.py）执行
+DEPLOY_MODE = os.getenv("DEPLOY_MODE", "single")
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_WAIT_TIMEOUT = float(os.getenv("JOB_WAIT_TIMEOUT", "3600"))
+
+
+@app.on_event("startup")
+async def start_embedded_worker():
+    if DEPLOY_MODE == "single":
+        worker = Worker()
+        threading.Thread(target=worker.run, name="embedded-worker", daemon=True).start()
+
+
+def validate_input(file: Optional[UploadFile], video_path: Optional[str]):
+    # 校验：file 和 video_path 不能同时为空，也不能同时存在
+    if file is None and not video_path:
+        raise HTTPException(
+            status_code=400,
+            detail="必须提供 'file' 上传文件 或 'video_path' 参数。",
+        )
+    if file is not None and video_path:
+        raise HTTPException(
+            status_code=400,
+            detail="'file' 和 'video_path' 不能同时提供，请二选一。",
+        )
+
+
+def prepare_input(
+    file: Optional[UploadFile], video_path: Optional[str], job_dir: str
+) -> tuple[str, str]:
+    """准备输入视频，返回 (本地路径, 来源标识)，来源标识用于合并重复任务"""
+    # 情况1：上传了文件，保存到任务目录（队列模式下 worker 从共享目录读取）
+    if file is not None:
+        if file.filename == "":
+            raise HTTPException(status_code=400, detail="上传的文件名为空。")
+        suffix = os.path.splitext(file.filename)[1]
+        actual_video_path = os.path.join(job_dir, "input" + (suffix or ".tmp"))
+        # 边写入边计算内容哈希
+        sha256 = hashlib.sha256()
+        with open(actual_video_path, "wb") as tmp:
+            while chunk := file.file.read(1024 * 1024):
+                sha256.update(chunk)
+                tmp.write(chunk)
+        return actual_video_path, f"sha256:{sha256.hexdigest()}"
+    # 情况2：使用提供的 video_path
+    if not os.path.exists(video_path):
+        raise HTTPException(
+            status_code=400, detail=f"指定的 video_path 不存在: {video_path}"
+        )
+    return video_path, source_identity(video_path)
+
+
+async def enqueue_job(
+    actual_video_path: str,
+    transcript_id: Optional[str],
+    job_dir: str,
+    key: str,
+    mode: str = "full",
+) -> tuple[str, bool]:
+    job_id, created = await run_in_threadpool(
+        get_job_queue().enqueue,
+        {
+            "video_path": actual_video_path,
+            "transcript_id": transcript_id,
+            "job_dir": job_dir,
+            "mode": mode,
+        },
+        dedupe_key=key,
+    )
+    if not created:
+        # 已有相同任务在执行，本次请求的任务目录（仅含上传文件）不再需要
+        await run_in_threadpool(get_workspace().discard, job_dir)
+    return job_id, created
+
+
+async def wait_for_job(job_id: str) -> dict:
+    queue = get_job_queue()
+    deadline = time.monotonic() + JOB_WAIT_TIMEOUT
+    while True:
+        job = await run_in_threadpool(queue.get, job_id)
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        if time.monotonic() > deadline:
+            return job
+        await asyncio.sleep(JOB_POLL_INTERVAL)
+
+
+# 接口边界：结果中的字幕列表经 SubtitleData 校验后输出，流水线内部只使用 Cue
+SUBTITLE_LIST = TypeAdapter(list[SubtitleData])
+SUBTITLE_FIELDS = ("subtitle_data", "handled_subtitle_data")
+
+
+def serialize_result(result: Optional[dict]) -> Optional[dict]:
+    if not result:
+        return result
+    result = dict(result)
+    for field in SUBTITLE_FIELDS:
+        if result.get(field) is not None:
+            result[field] = SUBTITLE_LIST.dump_python(
+                SUBTITLE_LIST.validate_python(result[field])
+            )
+    return result
+
+
+# 单进程模式下的请求合并（队列模式由任务队列按 dedupe_key 合并）
+single_flight = SingleFlight()
+
+
+def mode_key(source: str, transcript_id: Optional[str], mode: str) -> str:
+    # 完整流程沿用原有去重键；只生成字幕的任务与其分开合并
+    return job_key(source, transcript_id, None if mode == "full" else {"mode": mode})
+
+
+def validate_mode(mode: str):
+    if mode not in MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的处理模式: {mode}")
 
 
 # ====== POST 接口支持 file 或 video_path ======
@@ -48,80 +237,95 @@ async def transcribe_api(
     transcript_id: Optional[str] = Form(None),
     _: None = Depends(rate_limit_by_ip),
 ):
-    temp_video_path = None
-    actual_video_path = None
+    return await process_request(file, video_path, transcript_id, "full")
+
+
+@app.post("/subtitles")
+async def subtitles_api(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    video_path: Optional[str] = Form(None),
+    transcript_id: Optional[str] = Form(None),
+    _: None = Depends(rate_limit_by_ip),
+):
+    # 只生成字幕：ASR 只上传提取出的音轨，断行后直接返回 SRT / VTT / ASS 与字幕 JSON，不编码视频
+    return await process_request(file, video_path, transcript_id, "subtitles")
+
+
+async def process_request(
+    file: Optional[UploadFile],
+    video_path: Optional[str],
+    transcript_id: Optional[str],
+    mode: str,
+):
+    workspace = get_workspace()
+    job_dir = None
+    # 任务目录是否已移交给共享执行 / worker（移交后由对方负责释放）
+    handed_off = False
 
     try:
-        # 校验：file 和 video_path 不能同时为空，也不能同时存在
-        if file is None and not video_path:
-            raise HTTPException(
-                status_code=400,
-                detail="必须提供 'file' 上传文件 或 'video_path' 参数。",
-            )
-        if file is not None and video_path:
-            raise HTTPException(
-                status_code=400,
-                detail="'file' 和 'video_path' 不能同时提供，请二选一。",
-            )
+        validate_input(file, video_path)
+
+        # 本任务的工作目录（下载、上传、字幕与输出视频都放在这里）
+        # 工作目录操作涉及文件 IO 与配额淘汰，放线程池，不阻塞事件循环
+        job_dir = await run_in_threadpool(workspace.create)
+        actual_video_path, source = await run_in_threadpool(
+            prepare_input, file, video_path, job_dir
+        )
+        key = mode_key(source, transcript_id, mode)
+
+        if DEPLOY_MODE != "queue":
+            if single_flight.inflight(key):
+                # 相同输入正在处理，直接等待其结果
+                await run_in_threadpool(workspace.discard, job_dir)
+                handed_off = True
+                result, shared = await single_flight.do(key, None)
+                return serialize_result(result)
 
-        # 情况1：上传了文件
-        if file is not None:
-            if file.filename == "":
-                raise HTTPException(status_code=400, detail="上传的文件名为空。")
-            suffix = os.path.splitext(file.filename)[1]
-            with tempfile.NamedTemporaryFile(
-                delete=False, suffix=suffix or ".tmp"
-            ) as tmp:
-                shutil.copyfileobj(file.file, tmp)
-                temp_video_path = tmp.name
-                actual_video_path = temp_video_path
-        # 情况2：使用提供的 video_path
-        else:
-            if not os.path.exists(video_path):
-                raise HTTPException(
-                    status_code=400, detail=f"指定的 video_path 不存在: {video_path}"
+            async def run():
+                # 相同输入的请求固定使用同一任务目录，上次失败时从最后完成的阶段继续
+                resume_dir = await run_in_threadpool(
+                    workspace.adopt, job_dir, f"job_{key[:16]}"
                 )
-            actual_video_path = video_path
+                final_dir = resume_dir
+                # 上传的文件已随目录移动
+                video = relocate(actual_video_path, job_dir, resume_dir)
+                # 同步流程放线程池
+                try:
+                    result = await run_in_threadpool(
+                        run_pipeline, video, transcript_id, resume_dir, mode
+                    )
+                    # 成功后目录改回本次请求的独立名称：固定目录只保留未完成的任务，
+                    # 之后相同输入的请求重新处理，能用上新的配置与提示词
+                    final_dir = await run_in_threadpool(
+                        workspace.adopt, resume_dir, os.path.basename(job_dir)
+                    )
+                    if "output_path" in result:
+                        result["output_path"] = relocate(
+                            result["output_path"], resume_dir, final_dir
+                        )
+                    return result
+                finally:
+                    await run_in_threadpool(workspace.release, final_dir)
 
-        # 调用转录（同步函数放线程池）
-        assemblyai_key = os.getenv("ASSEMBLYAI_KEY")
-        trans = Transcriber(assemblyai_key)
-        transcript, returned_video_path = await run_in_threadpool(
-            trans.exec, actual_video_path, transcript_id
-        )
+            handed_off = True
+            result, shared = await single_flight.do(key, run)
+            return serialize_result(result)
 
-        # 按语句拆分文本
-        result = transcript.json_response
-        utterances = result.get("utterances", [])
-        utterances = [s for u in utterances for s in split_sentence_by_dot(u)]
-        result["utterances"] = utterances
-
-        # 翻译文本为中文
-        texts = [{"text": u["text"]} for u in utterances]
-
-        openai_key = os.getenv("OPENAI_KEY")
-        base_url = os.getenv("OPENAI_BASE_URL")
-        translator = OpenaiTranslator(base_url, openai_key, returned_video_path)
-        subtitle_texts = await run_in_threadpool(translator.exec, texts)
-
-        # 生成字幕数据
-        subtitle_data = generate_subtitle_data(utterances, subtitle_texts)
-
-        # 生成字幕，并将字幕嵌入视频
-        embeder = SubtitleEmbed(video_path=returned_video_path, data=subtitle_data)
-        output_path = await run_in_threadpool(embeder.embed)
-
-        return {
-            "status": "success",
-            "output_path": output_path,
-            "voice": result,
-            "translated_texts": translator.translated_texts,
-            "subtitle_data": [s.model_dump() for s in subtitle_data],
-            "handled_subtitle_data": [s.model_dump() for s in embeder.data],
-        }
+        # 队列模式：入队后等待 worker 完成，目录由 worker 负责释放
+        job_id, created = await enqueue_job(
+            actual_video_path, transcript_id, job_dir, key, mode
+        )
+        handed_off = True
+        job = await wait_for_job(job_id)
+        if job["status"] == "failed":
+            raise JobFailedError(job["error"])
+        if job["status"] != "succeeded":
+            return {"status": job["status"], "job_id": job_id}
+        return serialize_result(job["result"])
 
     except Exception as e:
-        error_info = {
+        error_info = getattr(e, "error_info", None) or {
             "status": "error",
             "error_type": type(e).__name__,
             "error_message": str(e),
@@ -130,9 +334,153 @@ async def transcribe_api(
         raise HTTPException(status_code=500, detail=error_info)
 
     finally:
-        # 清理临时上传的文件（不要删除用户提供的 video_path！）
-        if temp_video_path and os.path.exists(temp_video_path):
-            os.unlink(temp_video_path)
+        # 任务结束：目录交由工作目录管理器按 TTL / 配额回收
+        # （用户提供的 video_path 不在任务目录中，不会被删除）
+        if job_dir and not handed_off:
+            await run_in_threadpool(workspace.release, job_dir)
+
+
+def relocate(path: str, old_dir: str, new_dir: str) -> str:
+    """任务目录改名后，目录内文件的新路径；目录外的路径（用户提供的 video_path）不变"""
+    if old_dir == new_dir or not path.startswith(old_dir + os.sep):
+        return path
+    return os.path.join(new_dir, os.path.relpath(path, old_dir))
+
+
+# ====== 异步任务接口：立即返回 job_id，通过 GET /jobs/{job_id} 查询结果 ======
+@app.post("/jobs")
+async def submit_job_api(
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    video_path: Optional[str] = Form(None),
+    transcript_id: Optional[str] = Form(None),
+    mode: str = Form("full"),
+    _: None = Depends(rate_limit_by_ip),
+):
+    # mode: full（生成字幕并烧录进视频）或 subtitles（只生成字幕）
+    validate_input(file, video_path)
+    validate_mode(mode)
+    workspace = get_workspace()
+    job_dir = await run_in_threadpool(workspace.create)
+    try:
+        actual_video_path, source = await run_in_threadpool(
+            prepare_input, file, video_path, job_dir
+        )
+        key = mode_key(source, transcript_id, mode)
+        job_id, created = await enqueue_job(
+            actual_video_path, transcript_id, job_dir, key, mode
+        )
+    except Exception:
+        await run_in_threadpool(workspace.release, job_dir)
+        raise
+    return {"status": "queued", "job_id": job_id, "deduplicated": not created}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job_api(job_id: str):
+    job = await run_in_threadpool(get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    job_dir = job["payload"].get("job_dir")
+    checkpoints = CheckpointStore(job_dir).completed() if job_dir else []
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "checkpoints": checkpoints,
+        "result": serialize_result(job["result"]),
+        "error": job["error"],
+    }
+
+
+@app.get("/jobs/{job_id}/trace")
+async def get_job_trace_api(job_id: str, format: str = "otlp"):
+    # format: otlp（OTLP/JSON）或 chrome（Chrome trace-event，可在 Perfetto 中打开）
+    if format not in ("otlp", "chrome"):
+        raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+    job = await run_in_threadpool(get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    trace = await run_in_threadpool(
+        load_trace, job["payload"].get("job_dir") or "", format
+    )
+    if trace is None:
+        raise HTTPException(status_code=404, detail=f"任务尚无 trace: {job_id}")
+    return trace
+
+
+@app.get("/jobs/{job_id}/subtitles")
+async def get_job_subtitles_api(job_id: str, format: str = "srt"):
+    # format: srt / vtt / ass / ttml；只读取字幕检查点，不涉及视频处理，按格式缓存在任务目录
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+    job = await run_in_threadpool(get_job_queue().get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    job_dir = job["payload"].get("job_dir")
+    path = await run_in_threadpool(cached_render, job_dir, format) if job_dir else None
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"任务尚无字幕: {job_id}")
+    await run_in_threadpool(get_workspace().touch, job_dir)
+    return FileResponse(
+        path, media_type=MEDIA_TYPES[format], filename=f"{job_id}.{format}"
+    )
+
+
+class CueEdit(BaseModel):
+    index: int  # handled_subtitle_data 中的下标
+    text: Optional[str] = None
+    start: Optional[int] = None
+    end: Optional[int] = None
+    font_color: Optional[str] = None
+
+
+class SubtitlePatch(BaseModel):
+    edits: list[CueEdit]
+
+
+@app.patch("/jobs/{job_id}/subtitles")
+async def patch_job_subtitles_api(job_id: str, body: SubtitlePatch):
+    # 修改已完成任务的个别字幕，只重新编码受影响的关键帧区间并拼接回原输出视频
+    queue = get_job_queue()
+    job = await run_in_threadpool(queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=409, detail=f"任务尚未完成: {job_id}")
+    job_dir = job["payload"].get("job_dir")
+    edits = [e.model_dump(exclude_none=True) for e in body.edits]
+    try:
+        patched = await run_in_threadpool(patch_subtitles, job_dir, edits)
+    except (IndexError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if patched is None:
+        raise HTTPException(status_code=404, detail=f"任务尚无字幕: {job_id}")
+    await run_in_threadpool(get_workspace().touch, job_dir)
+    if patched["changed_ranges"]:
+        result = await run_in_threadpool(patched_result, job["result"], job_dir)
+        await run_in_threadpool(queue.update_result, job_id, result)
+    return patched
+
+
+def patched_result(result: Optional[dict], job_dir: str) -> dict:
+    """按修改后的字幕检查点更新任务结果中的字幕 JSON，以及只生成字幕模式下的字幕文本"""
+    result = dict(result or {})
+    subtitles = CheckpointStore(job_dir).load("subtitles")
+    result["handled_subtitle_data"] = subtitles["handled_subtitle_data"]
+    if "subtitles" in result:
+        document = SubtitleDocument.from_checkpoint(subtitles)
+        result["subtitles"] = {fmt: render(document, fmt) for fmt in SUBTITLE_FORMATS}
+    return result
+
+
+@app.post("/jobs/{job_id}/retry")
+async def retry_job_api(job_id: str):
+    # 重新入队后 worker 从最后完成的阶段继续执行
+    retried = await run_in_threadpool(get_job_queue().retry, job_id)
+    if not retried:
+        raise HTTPException(status_code=409, detail=f"任务不存在或未失败: {job_id}")
+    return {"status": "queued", "job_id": job_id}
 
 
 # 主启动逻辑保持不变
@@ -158,10 +506,19 @@ if __name__ == "__main__":
     parser.add_argument(
         "--ssl-certfile", type=str, default=None, help="SSL 证书文件路径"
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=int(os.getenv("API_WORKERS", "1")),
+        help="API 进程数 (默认: 1)",
+    )
 
     args = parser.parse_args()
     uvicorn.run(
-        app,
+        # 多进程时 uvicorn 需要以导入字符串的形式加载应用
+        app if args.workers <= 1 else "main:app",
+        workers=args.workers,
         host=args.host,
         port=args.port,
         log_level="info",
@@ -0,0 +1,297 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tracing import span
+
+
+# 轻量 Prometheus 指标（文本格式 0.0.4），不引入额外依赖
+# 每个进程独立统计：API 进程通过 /metrics 暴露，worker 进程通过 --metrics-port 暴露
+
+DEFAULT_DURATION_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+    1800,
+)
+DEFAULT_BYTES_BUCKETS = tuple(1024 * 4**i for i in range(12))  # 1KB ~ 4GB
+DEFAULT_TOKENS_BUCKETS = (16, 64, 256, 1024, 2048, 4096, 8192, 16384, 32768, 65536)
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self) -> list[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        with self._lock:
+            for key, value in self._values.items():
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_total{labels} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        """callback: 抓取时调用，返回当前值（无标签指标）"""
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        if not self.labelnames:
+            self._values[()] = 0
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        if self.callback is not None:
+            try:
+                self.set(self.callback())
+            except Exception as e:
+                print(f"指标采集失败 {self.name}: {e}")
+        with self._lock:
+            for key, value in self._values.items():
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_DURATION_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [各桶计数..., 总和, 总数]
+                entry = [0] * len(self.buckets) + [0.0, 0]
+                self._values[key] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict[tuple, tuple[float, int]]:
+        """各标签组合的 (总和, 次数)，供基准测试计算区间内的平均值"""
+        with self._lock:
+            return {key: (entry[-2], entry[-1]) for key, entry in self._values.items()}
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        with self._lock:
+            for key, entry in self._values.items():
+                cumulative = 0
+                for i, bound in enumerate(self.buckets):
+                    cumulative += entry[i]
+                    labels = _format_labels(
+                        self.labelnames, key, ("le", _format_value(bound))
+                    )
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(entry[-2])}")
+                lines.append(f"{self.name}_count{labels} {entry[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            # 同名指标只注册一次，重复定义时返回已有实例
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name, documentation, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name, documentation, labelnames=(), callback=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames, callback))
+
+
+def histogram(
+    name, documentation, labelnames=(), buckets=DEFAULT_DURATION_BUCKETS
+) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# ====== 流程指标 ======
+STAGE_DURATION = histogram(
+    "videotingyi_stage_duration_seconds", "各处理阶段耗时", ["stage"]
+)
+STAGE_BYTES = histogram(
+    "videotingyi_stage_bytes",
+    "各处理阶段处理的数据量（下载、上传、输出文件大小）",
+    ["stage"],
+    DEFAULT_BYTES_BUCKETS,
+)
+LLM_TOKENS = histogram(
+    "videotingyi_llm_tokens",
+    "单次 LLM 调用的 token 数",
+    ["op", "kind"],
+    DEFAULT_TOKENS_BUCKETS,
+)
+UPSTREAM_CALLS = counter(
+    "videotingyi_upstream_calls", "上游服务调用次数", ["service", "op", "outcome"]
+)
+JOBS = counter("videotingyi_jobs", "任务数", ["outcome"])
+INFLIGHT_JOBS = gauge("videotingyi_inflight_jobs", "执行中的任务数")
+INFLIGHT_ENCODES = gauge("videotingyi_inflight_encodes", "执行中的 ffmpeg 编码数")
+
+
+def _process_rss_bytes() -> int:
+    # Linux 下读取 /proc，其他平台退回 resource 的峰值 RSS
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+PROCESS_RSS = gauge(
+    "videotingyi_process_rss_bytes", "进程常驻内存", callback=_process_rss_bytes
+)
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """统计一个处理阶段的耗时，并在当前 trace 中记录同名 span"""
+    with span(name, **attributes) as s, STAGE_DURATION.time(stage=name):
+        yield s
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """在后台线程中提供 /metrics（供没有 HTTP 服务的 worker 进程使用）"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    return server
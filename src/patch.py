@@ -0,0 +1,220 @@
+import os
+import shutil
+import threading
+import weakref
+from difflib import SequenceMatcher
+
+import ffmpeg
+
+from checkpoint import CheckpointStore
+from embed import SubtitleEmbed
+from render import DEFAULT_STYLE, StyleTable, SubtitleDocument, render_to_file
+from subtitle import SubtitleCreator
+from utils import Cue, SubtitleSize, VideoDimension, modify_separator
+from metrics import stage
+
+# 修改已完成任务的个别字幕：对比新旧字幕找出变化的时间段，扩展到输出视频的关键帧边界，
+# 只重新编码这些片段，其余部分从原输出视频流复制，最后拼接并替换原输出
+
+# 同一任务的修改串行执行；没有请求持有时锁随之回收，不随任务数增长
+_locks = weakref.WeakValueDictionary()
+_locks_guard = threading.Lock()
+
+
+def _job_lock(job_dir: str) -> threading.Lock:
+    with _locks_guard:
+        lock = _locks.get(job_dir)
+        if lock is None:
+            lock = _locks[job_dir] = threading.Lock()
+        return lock
+
+
+def _key(cue: Cue) -> tuple:
+    return (cue.text, cue.start, cue.end, cue.font_color, cue.speaker)
+
+
+def apply_edits(cues: list[Cue], edits: list[dict], creator: SubtitleCreator):
+    """按下标替换字幕条目的字段；修改了文本且未手动断行的条目重新断行"""
+    cues = list(cues)
+    # 从后往前处理，重新断行拆出的多条字幕不影响前面的下标
+    for edit in sorted(edits, key=lambda e: e["index"], reverse=True):
+        index = edit["index"]
+        if not 0 <= index < len(cues):
+            raise IndexError(f"字幕下标越界: {index}")
+        old = cues[index]
+        fields = {k: v for k, v in edit.items() if k != "index" and v is not None}
+        cue = Cue(**{**old.to_dict(), **fields})
+        if cue.start > cue.end:
+            raise ValueError(f"字幕 {index} 的开始时间晚于结束时间")
+        if "text" in fields and r"\n" not in cue.text:
+            creator.data = [cue]
+            creator.handle_oversize_sentences()
+            cues[index : index + 1] = creator.data
+        else:
+            cues[index] = cue
+    return cues
+
+
+def diff_ranges(old: list[Cue], new: list[Cue]) -> list[tuple[int, int]]:
+    """新旧字幕中发生变化的时间范围（毫秒），新旧条目的时间都计入"""
+    ranges = []
+    matcher = SequenceMatcher(None, [_key(c) for c in old], [_key(c) for c in new])
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        for cue in old[i1:i2] + new[j1:j2]:
+            ranges.append((cue.start, cue.end))
+    return ranges
+
+
+def keyframe_times(video_path) -> list[float]:
+    """读取视频流中关键帧的时间（秒），只读取包头，不解码"""
+    probe = ffmpeg.probe(
+        video_path, select_streams="v:0", show_entries="packet=pts_time,flags"
+    )
+    return sorted(
+        float(p["pts_time"])
+        for p in probe.get("packets", [])
+        if "K" in p.get("flags", "") and p.get("pts_time") not in (None, "N/A")
+    )
+
+
+def video_duration(video_path) -> float:
+    return float(ffmpeg.probe(video_path)["format"]["duration"])
+
+
+def segments_for(ranges, keyframes: list[float], duration: float):
+    """把变化的时间范围扩展到关键帧边界并合并，返回 [(开始秒, 结束秒)]"""
+    spans = []
+    for start_ms, end_ms in sorted(ranges):
+        start, end = start_ms / 1000, end_ms / 1000
+        a = max((k for k in keyframes if k <= start), default=0.0)
+        b = min((k for k in keyframes if k > end), default=duration)
+        if spans and a <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], b))
+        else:
+            spans.append((a, b))
+    return spans
+
+
+def _shifted_document(doc: SubtitleDocument, start: float, end: float):
+    """片段内的字幕，时间平移为相对片段开始"""
+    offset = int(start * 1000)
+    limit = int(end * 1000)
+    cues = [
+        Cue(
+            c.text,
+            max(0, c.start - offset),
+            c.end - offset,
+            c.font_color,
+            c.font_size,
+            c.speaker,
+        )
+        for c in doc.cues
+        if c.end > offset and c.start < limit
+    ]
+    return SubtitleDocument(
+        cues, doc.video_width, doc.video_height, doc.font_size, doc.styles
+    )
+
+
+def splice(embeder, doc, output_path, spans, work_dir) -> float:
+    """重新编码 spans 内的画面并与原输出的其余部分拼接，返回重新编码的总秒数"""
+    duration = video_duration(output_path)
+    list_lines = []
+    cursor = 0.0
+    encoded = 0.0
+    for i, (start, end) in enumerate(spans):
+        if start > cursor:
+            list_lines += [
+                f"file '{modify_separator(os.path.abspath(output_path))}'",
+                f"inpoint {cursor:.6f}",
+                f"outpoint {start:.6f}",
+            ]
+        subtitle_path = os.path.join(work_dir, f"segment_{i}.ass")
+        render_to_file(_shifted_document(doc, start, end), "ass", subtitle_path)
+        segment_path = os.path.join(work_dir, f"segment_{i}.mp4")
+        embeder.encode_segment(subtitle_path, segment_path, start, end - start)
+        list_lines.append(f"file '{modify_separator(os.path.abspath(segment_path))}'")
+        encoded += end - start
+        cursor = end
+    if cursor < duration:
+        list_lines += [
+            f"file '{modify_separator(os.path.abspath(output_path))}'",
+            f"inpoint {cursor:.6f}",
+        ]
+    list_path = os.path.join(work_dir, "concat.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(list_lines) + "\n")
+
+    # 画面按片段拼接，音轨整条取自原输出，避免片段边界处的音频间隙
+    tmp_path = os.path.join(work_dir, "output.mp4")
+    video = ffmpeg.input(list_path, format="concat", safe=0)
+    audio = ffmpeg.input(output_path)
+    with stage("splice"):
+        ffmpeg.output(video["v"], audio["a?"], tmp_path, c="copy").run(
+            overwrite_output=True, quiet=True
+        )
+    os.replace(tmp_path, output_path)
+    return encoded
+
+
+def patch_subtitles(job_dir: str, edits: list[dict]) -> dict | None:
+    """修改已完成任务的字幕并局部重新编码输出视频；任务尚无字幕时返回 None"""
+    ckpt = CheckpointStore(job_dir)
+    with _job_lock(job_dir):
+        if not ckpt.has("subtitles"):
+            return None
+        subtitles = ckpt.load("subtitles")
+        old_doc = SubtitleDocument.from_checkpoint(subtitles)
+        creator = SubtitleCreator(
+            [],
+            subtitle_size=SubtitleSize(
+                video_dim=VideoDimension(
+                    width=old_doc.video_width, height=old_doc.video_height
+                ),
+                font_size=old_doc.font_size,
+            ),
+        )
+        cues = apply_edits(old_doc.cues, edits, creator)
+        ranges = diff_ranges(old_doc.cues, cues)
+        styles = old_doc.styles
+        if any(styles.name_for(c) == DEFAULT_STYLE and c.font_color for c in cues):
+            # 出现了新的 说话人 / 颜色 组合
+            styles = StyleTable.build(cues)
+        doc = SubtitleDocument(
+            cues, old_doc.video_width, old_doc.video_height, old_doc.font_size, styles
+        )
+        result = {"changed_ranges": ranges, "segments": [], "reencoded_seconds": 0.0}
+        if not ranges:
+            return result
+
+        # 先替换输出视频，成功后再写字幕文件与检查点：重新编码失败时检查点仍是旧字幕，
+        # 下次修改会重新对比出这些变化（只生成字幕的任务没有输出视频）
+        if ckpt.has("output"):
+            output_path = ckpt.load("output")["output_path"]
+            embeder = SubtitleEmbed(subtitles["video_path"], cues, temp_dir=job_dir)
+            embeder.video_width = doc.video_width
+            embeder.video_height = doc.video_height
+            spans = segments_for(
+                ranges, keyframe_times(output_path), video_duration(output_path)
+            )
+            work_dir = os.path.join(job_dir, "patch")
+            os.makedirs(work_dir, exist_ok=True)
+            try:
+                with stage("patch", segments=len(spans)):
+                    encoded = splice(embeder, doc, output_path, spans, work_dir)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            result.update(
+                segments=[[round(a, 3), round(b, 3)] for a, b in spans],
+                reencoded_seconds=round(encoded, 3),
+                output_path=output_path,
+            )
+
+        # 完整字幕文件与检查点（各格式的缓存按检查点时间自动失效）
+        render_to_file(doc, "ass", subtitles["subtitle_path"])
+        subtitles["handled_subtitle_data"] = [c.to_dict() for c in cues]
+        subtitles["styles"] = styles.styles
+        ckpt.save("subtitles", subtitles)
+        return result
@@ -0,0 +1,184 @@
+import os
+
+from trans import Transcriber, OpenaiTranslator
+from utils import generate_subtitle_data, create_tempdir, download_file, extract_audio
+from utils import Cue
+from embed import SubtitleEmbed
+from checkpoint import CheckpointStore
+from columnar import TranscriptColumns
+from language import detect_language, needs_translation
+from vad import VAD_TRIM, remap_transcript, trim_silence
+from render import SubtitleDocument, render
+from metrics import stage, JOBS, INFLIGHT_JOBS
+from tracing import start_trace
+
+# 字幕时间分配方式：linear 按文本长度在语句内均分；words 按词的发声时间加权，跳过停顿
+TIMING_BY_WORDS = os.getenv("SUBTITLE_TIMING", "linear") == "words"
+# 处理模式：full 生成字幕并烧录进视频；subtitles 只生成字幕，不编码视频
+MODES = ("full", "subtitles")
+# subtitles 模式直接返回的字幕格式（其他格式可通过 /jobs/{job_id}/subtitles 获取）
+SUBTITLE_FORMATS = ("srt", "vtt", "ass")
+
+
+def transcribe_stage(video_path, transcript_id, job_dir, audio_only=False) -> dict:
+    assemblyai_key = os.getenv("ASSEMBLYAI_KEY")
+    trans = Transcriber(assemblyai_key)
+    vad = None
+    if (audio_only or VAD_TRIM) and transcript_id is None:
+        # 只上传音轨：流复制提取，不解码视频；视频仍保留用于读取分辨率
+        if video_path.startswith("http"):
+            video_path = download_file(video_path, job_dir)
+        audio_path = extract_audio(video_path, job_dir)
+        offsets = None
+        if VAD_TRIM:
+            audio_path, offsets, vad = trim_silence(audio_path, job_dir)
+        transcript, _ = trans.exec(audio_path, transcript_id, job_dir)
+        json_response = transcript.json_response
+        if offsets is not None:
+            # 断句前把时间换算回原视频时间，后续阶段无需感知裁剪
+            json_response = remap_transcript(json_response, offsets)
+        returned_video_path = video_path
+    else:
+        transcript, returned_video_path = trans.exec(
+            video_path, transcript_id, job_dir
+        )
+        json_response = transcript.json_response
+    return {
+        "transcript_id": transcript.id,
+        "json_response": json_response,
+        "video_path": returned_video_path,
+        "vad": vad,
+    }
+
+
+def subtitle_stage(embeder: SubtitleEmbed) -> dict:
+    subtitle_path = embeder.prepare()
+    return {
+        "subtitle_path": subtitle_path,
+        "video_path": embeder.video_path,
+        "video_width": embeder.video_width,
+        "video_height": embeder.video_height,
+        "font_size": embeder.font_size,
+        "styles": embeder.styles.styles,
+        "handled_subtitle_data": [c.to_dict() for c in embeder.data],
+    }
+
+
+# 完整处理流程：转录 -> 按句拆分 -> 翻译 -> 生成字幕数据 -> 嵌入视频
+# API 进程（单进程模式）与 worker 进程（队列模式）共用
+# 每个阶段的输出都保存为任务目录下的检查点，失败重试时从最后完成的阶段继续
+def run_pipeline(video_path, transcript_id=None, job_dir=None, mode="full") -> dict:
+    if job_dir is None:
+        job_dir = create_tempdir()
+    with start_trace() as trace:
+        try:
+            with INFLIGHT_JOBS.track_inprogress(), stage("pipeline"):
+                result = _run_pipeline(video_path, transcript_id, job_dir, mode)
+        except Exception:
+            JOBS.inc(outcome="error")
+            raise
+        finally:
+            # 失败的任务同样保存 trace，便于定位卡在哪个阶段
+            if trace is not None:
+                trace.save(job_dir)
+    JOBS.inc(outcome="success")
+    if trace is not None:
+        result["trace_id"] = trace.trace_id
+    return result
+
+
+def _run_pipeline(video_path, transcript_id, job_dir, mode="full") -> dict:
+    ckpt = CheckpointStore(job_dir)
+    subtitles_only = mode == "subtitles"
+
+    # 调用转录
+    transcribed = ckpt.run(
+        "transcript",
+        transcribe_stage,
+        video_path,
+        transcript_id,
+        job_dir,
+        audio_only=subtitles_only,
+    )
+    returned_video_path = transcribed["video_path"]
+
+    # 按语句拆分文本；句子在流水线内保持列式存储，检查点保存紧凑的列，只在接口响应时还原为 dict
+    result = transcribed["json_response"]
+    sentences = TranscriptColumns.from_checkpoint(
+        ckpt.run(
+            "sentences",
+            lambda: TranscriptColumns.from_response(result)
+            .split_sentences()
+            .to_checkpoint(),
+        )
+    )
+
+    # 翻译文本为中文；源语言已是中文时跳过翻译，直接本地拆分
+    texts = [{"text": sentences.segment_text(i)} for i in range(len(sentences))]
+    language = detect_language(result)
+    translate = needs_translation(language)
+    if not translate:
+        print(f"源语言为 {language}，跳过翻译")
+
+    openai_key = os.getenv("OPENAI_KEY")
+    base_url = os.getenv("OPENAI_BASE_URL")
+    translator = OpenaiTranslator(base_url, openai_key, returned_video_path)
+    if translate:
+        translated_texts = ckpt.run("translations", translator.translate, texts)
+        subtitle_texts = ckpt.run("splits", translator.split_all, translated_texts)
+    else:
+        translated_texts = ckpt.run("translations", lambda: texts)
+        subtitle_texts = ckpt.run("splits", translator.split_all_local, texts)
+
+    # 生成字幕数据
+    subtitle_rows = ckpt.run(
+        "subtitle_data",
+        lambda: [
+            c.to_dict()
+            for c in generate_subtitle_data(
+                sentences, subtitle_texts, weight_by_words=TIMING_BY_WORDS
+            )
+        ],
+    )
+    subtitle_data = [Cue(**row) for row in subtitle_rows]
+
+    # 生成字幕，并将字幕嵌入视频
+    embeder = SubtitleEmbed(
+        video_path=returned_video_path, data=subtitle_data, temp_dir=job_dir
+    )
+    subtitles = ckpt.run("subtitles", subtitle_stage, embeder)
+    if subtitles_only:
+        # 断行完成即结束，跳过视频编码
+        document = SubtitleDocument.from_checkpoint(subtitles)
+        with stage("render"):
+            rendered = {fmt: render(document, fmt) for fmt in SUBTITLE_FORMATS}
+        result["utterances"] = sentences.to_dicts()
+        return {
+            "status": "success",
+            "subtitles": rendered,
+            "voice": result,
+            "language": language,
+            "vad": transcribed.get("vad"),
+            "translated_texts": translated_texts,
+            "subtitle_data": subtitle_rows,
+            "handled_subtitle_data": subtitles["handled_subtitle_data"],
+        }
+    embeder.video_path = subtitles["video_path"]
+    embeder.video_width = subtitles["video_width"]
+    embeder.video_height = subtitles["video_height"]
+    encoded = ckpt.run(
+        "output",
+        lambda: {"output_path": embeder.encode(subtitles["subtitle_path"])},
+    )
+    result["utterances"] = sentences.to_dicts()
+
+    return {
+        "status": "success",
+        "output_path": encoded["output_path"],
+        "voice": result,
+        "language": language,
+        "vad": transcribed.get("vad"),
+        "translated_texts": translated_texts,
+        "subtitle_data": subtitle_rows,
+        "handled_subtitle_data": subtitles["handled_subtitle_data"],
+    }
@@ -0,0 +1,191 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# ====== 限流策略 ======
+# 策略只负责状态转移：state 为三个浮点数的元组，由后端原子地读取与写回
+
+
+class TokenBucket:
+    """令牌桶：容量 capacity，每 period 秒补满 capacity 个令牌"""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        # 桶补满所需时间之后，状态与“从未请求过”等价，可以过期删除
+        self.ttl = period
+
+    def evaluate(self, state, now) -> tuple[bool, tuple, float]:
+        if state is None:
+            tokens, last = float(self.capacity), now
+        else:
+            tokens, last, _ = state
+            tokens = min(self.capacity, tokens + (now - last) * self.rate)
+        if tokens >= 1:
+            return True, (tokens - 1, now, 0.0), 0.0
+        retry_after = (1 - tokens) / self.rate
+        return False, (tokens, now, 0.0), retry_after
+
+
+class SlidingWindow:
+    """滑动窗口计数（上一窗口按剩余比例加权），保证估算请求数不超过 limit"""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.ttl = window * 2
+
+    def evaluate(self, state, now) -> tuple[bool, tuple, float]:
+        window_start = math.floor(now / self.window) * self.window
+        if state is None:
+            prev, curr = 0.0, 0.0
+        else:
+            start, prev, curr = state
+            if window_start - start >= self.window * 2:
+                prev, curr = 0.0, 0.0
+            elif window_start - start >= self.window:
+                prev, curr = curr, 0.0
+        weight = 1 - (now - window_start) / self.window
+        if prev * weight + curr + 1 <= self.limit:
+            return True, (window_start, prev, curr + 1), 0.0
+        elapsed = now - window_start
+        return False, (window_start, prev, curr), self._wait(prev, curr, elapsed)
+
+    def _wait(self, prev, curr, elapsed) -> float:
+        """解 prev * (1 - t / window) + curr + 1 <= limit，返回最早满足的时刻距现在的秒数
+
+        当前窗口内不可能满足时，看下一窗口（当前计数变为上一窗口计数）；仍不满足时
+        （如 limit=1）要等到再下一个窗口，两个窗口前的计数已不再参与估算
+        """
+        window = self.window
+        if curr + 1 <= self.limit:
+            # prev > 0，否则本次请求已放行
+            t = window * (1 - (self.limit - curr - 1) / prev)
+            if t < window:
+                return max(t, elapsed) - elapsed
+        t = max(0.0, window * (1 - (self.limit - 1) / curr)) if curr > 0 else 0.0
+        if t < window:
+            return window - elapsed + t
+        return 2 * window - elapsed
+
+
+# ====== 存储后端 ======
+
+
+class MemoryBackend:
+    """进程内存后端：LRU 有界，过期自动回收；仅适用于单进程部署"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # key -> (state, expires_at)
+        self._data: OrderedDict[str, tuple] = OrderedDict()
+
+    def hit(self, key, policy, now) -> tuple[bool, float]:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            state = entry[0] if entry and entry[1] > now else None
+            allowed, state, retry_after = policy.evaluate(state, now)
+            self._data[key] = (state, now + policy.ttl)
+            # 头部是最久未访问的 key：先清理过期项，再按容量淘汰
+            while self._data:
+                _, (_, expires_at) = next(iter(self._data.items()))
+                if expires_at > now and len(self._data) <= self.max_keys:
+                    break
+                self._data.popitem(last=False)
+            return allowed, retry_after
+
+
+class SqliteBackend:
+    """SQLite（WAL）后端：多个 uvicorn worker / 进程共享同一份限流状态"""
+
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._hits = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit ("
+            "key TEXT PRIMARY KEY, s0 REAL, s1 REAL, s2 REAL, expires_at REAL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS rate_limit_expires ON rate_limit(expires_at)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def hit(self, key, policy, now) -> tuple[bool, float]:
+        conn = self._conn()
+        # BEGIN IMMEDIATE 取得写锁，保证跨进程的读-改-写原子性
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT s0, s1, s2, expires_at FROM rate_limit WHERE key = ?", (key,)
+            ).fetchone()
+            state = tuple(row[:3]) if row and row[3] > now else None
+            allowed, state, retry_after = policy.evaluate(state, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limit (key, s0, s1, s2, expires_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, *state, now + policy.ttl),
+            )
+            self._hits += 1
+            if self._hits % self.PURGE_EVERY == 0:
+                conn.execute("DELETE FROM rate_limit WHERE expires_at <= ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+
+class RateLimiter:
+    def __init__(self, policy, backend, namespace: str = ""):
+        self.policy = policy
+        self.backend = backend
+        self.namespace = namespace
+
+    def hit(self, key: str) -> tuple[bool, float]:
+        """记录一次请求，返回 (是否放行, 建议重试等待秒数)"""
+        return self.backend.hit(f"{self.namespace}:{key}", self.policy, time.time())
+
+
+def create_rate_limiter(namespace: str = "") -> RateLimiter:
+    limit = int(os.getenv("RATE_LIMIT_LIMIT", "1"))
+    window = float(os.getenv("RATE_LIMIT_WINDOW_SECONDS", "86400"))
+    policy_name = os.getenv("RATE_LIMIT_POLICY", "token_bucket")
+    backend_name = os.getenv("RATE_LIMIT_BACKEND", "sqlite")
+
+    if policy_name == "token_bucket":
+        policy = TokenBucket(limit, window)
+    elif policy_name == "sliding_window":
+        policy = SlidingWindow(limit, window)
+    else:
+        raise ValueError(f"未知的限流策略: {policy_name}")
+
+    if backend_name == "sqlite":
+        backend = SqliteBackend(
+            os.getenv("RATE_LIMIT_DB", os.path.join(".", "data", "ratelimit.db"))
+        )
+    elif backend_name == "memory":
+        backend = MemoryBackend(int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000")))
+    else:
+        raise ValueError(f"未知的限流后端: {backend_name}")
+
+    return RateLimiter(policy, backend, namespace)
@@ -0,0 +1,240 @@
+import io
+import os
+import re
+import tempfile
+from xml.sax.saxutils import escape as xml_escape
+
+from utils import Cue, format_time, escape_ssa_text, hex_to_ssa_style_color
+from utils import font_size_for_height
+from checkpoint import CheckpointStore
+from metrics import stage
+
+# 字幕渲染：同一份断行后的字幕数据输出为 ASS / SRT / WebVTT / TTML
+# 每种格式一个渲染函数，只通过 write 回调输出，写字符串缓冲与写文件共用同一遍扫描
+# 任务目录下按格式缓存渲染结果，字幕检查点更新后自动重新渲染
+
+FORMATS = ("srt", "vtt", "ass", "ttml")
+MEDIA_TYPES = {
+    "srt": "application/x-subrip; charset=utf-8",
+    "vtt": "text/vtt; charset=utf-8",
+    "ass": "text/x-ssa; charset=utf-8",
+    "ttml": "application/ttml+xml; charset=utf-8",
+}
+# 断行后的字幕文本用字面量 \n 分隔各行（ASS 的软换行写法）
+LINE_SEPARATOR = r"\n"
+WRITE_BUFFER_SIZE = 1 << 16
+# ASS 样式名中不能出现逗号
+STYLE_NAME_UNSAFE = re.compile(r"[^0-9A-Za-z_]")
+DEFAULT_STYLE = "Default"
+
+
+class StyleTable:
+    """ASS 命名样式表：每种 说话人 / 颜色 组合一个样式，事件行只引用样式名，不再逐行写覆盖标签
+
+    样式表随字幕检查点保存，同一任务的各次渲染直接复用
+    """
+
+    __slots__ = ("styles", "_index")
+
+    def __init__(self, styles: list[dict]):
+        self.styles = styles  # [{"name", "speaker", "font_color"}]
+        self._index = {(s["speaker"], s["font_color"]): s["name"] for s in styles}
+
+    @classmethod
+    def build(cls, cues: list[Cue]) -> "StyleTable":
+        styles = []
+        names = {DEFAULT_STYLE}
+        seen = set()
+        for cue in cues:
+            key = (cue.speaker, cue.font_color)
+            if key in seen:
+                continue
+            seen.add(key)
+            # 颜色无效的字幕沿用 Default 样式
+            if hex_to_ssa_style_color(cue.font_color) is None:
+                continue
+            if cue.speaker:
+                base = "Speaker_" + STYLE_NAME_UNSAFE.sub("_", cue.speaker)
+            else:
+                base = "Color_" + cue.font_color.lstrip("#").upper()
+            name = base
+            n = 2
+            while name in names:
+                name = f"{base}_{n}"
+                n += 1
+            names.add(name)
+            styles.append(
+                {"name": name, "speaker": cue.speaker, "font_color": cue.font_color}
+            )
+        return cls(styles)
+
+    def name_for(self, cue: Cue) -> str:
+        return self._index.get((cue.speaker, cue.font_color), DEFAULT_STYLE)
+
+
+class SubtitleDocument:
+    __slots__ = ("cues", "video_width", "video_height", "font_size", "styles")
+
+    def __init__(
+        self,
+        cues: list[Cue],
+        video_width,
+        video_height,
+        font_size=None,
+        styles: StyleTable = None,
+    ):
+        self.cues = cues
+        self.video_width = video_width
+        self.video_height = video_height
+        self.font_size = font_size or font_size_for_height(video_height)
+        self.styles = styles or StyleTable.build(cues)
+
+    @classmethod
+    def from_checkpoint(cls, subtitles: dict) -> "SubtitleDocument":
+        """由流水线 subtitles 阶段的检查点构建"""
+        styles = subtitles.get("styles")
+        return cls(
+            [Cue(**row) for row in subtitles["handled_subtitle_data"]],
+            subtitles["video_width"],
+            subtitles["video_height"],
+            subtitles.get("font_size"),
+            StyleTable(styles) if styles is not None else None,
+        )
+
+
+def _ms_parts(ms):
+    ms = max(0, int(ms))
+    return ms // 3600000, ms % 3600000 // 60000, ms % 60000 // 1000, ms % 1000
+
+
+def format_srt_time(ms) -> str:
+    h, m, s, ms = _ms_parts(ms)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def format_vtt_time(ms) -> str:
+    h, m, s, ms = _ms_parts(ms)
+    return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
+
+
+def _lines(cue: Cue) -> list[str]:
+    return cue.text.split(LINE_SEPARATOR)
+
+
+def _ass_style(name, font_size, primary) -> str:
+    return (
+        f"Style: {name},Arial,{font_size},{primary},&H000000FF,&H00000000,"
+        "&H80000000,-1,0,3,2,2,2,20,20,30,0,1\n"
+    )
+
+
+def render_ass(doc: SubtitleDocument, write):
+    write(
+        f"""[Script Info]
+Title: Generated Subtitle
+ScriptType: v4.00+
+Collisions: Normal
+PlayDepth: 0
+PlayResX: {doc.video_width}
+PlayResY: {doc.video_height}
+WrapStyle: 1
+ScaledBorderAndShadow: yes
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, TertiaryColour, BackColour, Bold, Italic, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, AlphaLevel, Encoding
+"""
+    )
+    write(_ass_style(DEFAULT_STYLE, doc.font_size, "&H00FFFFFF"))
+    for style in doc.styles.styles:
+        primary = hex_to_ssa_style_color(style["font_color"])
+        write(_ass_style(style["name"], doc.font_size, primary))
+    write(
+        "\n[Events]\n"
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n"
+    )
+    name_for = doc.styles.name_for
+    for cue in doc.cues:
+        write(
+            f"Dialogue: 0,{format_time(cue.start)},{format_time(cue.end)},"
+            f"{name_for(cue)},,10,10,0,,{escape_ssa_text(cue.text)}\n"
+        )
+
+
+def render_srt(doc: SubtitleDocument, write):
+    for i, cue in enumerate(doc.cues, 1):
+        write(
+            f"{i}\n{format_srt_time(cue.start)} --> {format_srt_time(cue.end)}\n"
+            f"{chr(10).join(_lines(cue))}\n\n"
+        )
+
+
+def render_vtt(doc: SubtitleDocument, write):
+    write("WEBVTT\n\n")
+    for cue in doc.cues:
+        text = "\n".join(xml_escape(line) for line in _lines(cue))
+        write(f"{format_vtt_time(cue.start)} --> {format_vtt_time(cue.end)}\n")
+        write(f"{text}\n\n")
+
+
+def render_ttml(doc: SubtitleDocument, write):
+    write(
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<tt xmlns="http://www.w3.org/ns/ttml" '
+        'xmlns:tts="http://www.w3.org/ns/ttml#styling" xml:lang="zh">\n'
+        "<body><div>\n"
+    )
+    for cue in doc.cues:
+        text = "<br/>".join(xml_escape(line) for line in _lines(cue))
+        color = f' tts:color="{cue.font_color}"' if cue.font_color else ""
+        write(
+            f'<p begin="{format_vtt_time(cue.start)}" '
+            f'end="{format_vtt_time(cue.end)}"{color}>{text}</p>\n'
+        )
+    write("</div></body>\n</tt>\n")
+
+
+RENDERERS = {
+    "srt": render_srt,
+    "vtt": render_vtt,
+    "ass": render_ass,
+    "ttml": render_ttml,
+}
+
+
+def render(doc: SubtitleDocument, fmt: str) -> str:
+    buf = io.StringIO()
+    RENDERERS[fmt](doc, buf.write)
+    return buf.getvalue()
+
+
+def render_to_file(doc: SubtitleDocument, fmt: str, path: str) -> str:
+    """渲染到文件：先写临时文件再原子替换，并发请求同一格式时不会读到半个文件"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # 每次渲染使用独立的临时文件：同一进程内多个线程可能同时渲染同一格式
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", suffix=".tmp"
+    )
+    try:
+        with open(
+            fd, "w", encoding="utf-8", newline="\n", buffering=WRITE_BUFFER_SIZE
+        ) as f:
+            RENDERERS[fmt](doc, f.write)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def cached_render(job_dir: str, fmt: str) -> str | None:
+    """返回任务目录下某种格式的字幕文件；尚无字幕时返回 None"""
+    ckpt = CheckpointStore(job_dir)
+    if not ckpt.has("subtitles"):
+        return None
+    path = os.path.join(job_dir, "subtitles", f"subtitles.{fmt}")
+    if os.path.exists(path) and os.path.getmtime(path) >= ckpt.mtime("subtitles"):
+        return path
+    doc = SubtitleDocument.from_checkpoint(ckpt.load("subtitles"))
+    with stage("render", format=fmt):
+        return render_to_file(doc, fmt, path)
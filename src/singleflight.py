@@ -0,0 +1,54 @@
+import asyncio
+import hashlib
+import json
+import os
+
+
+def source_identity(video_path: str) -> str:
+    """视频来源标识：URL 直接使用；本地文件使用路径 + 大小 + 修改时间（避免对大文件求哈希）"""
+    if video_path.startswith("http"):
+        return f"url:{video_path}"
+    stat = os.stat(video_path)
+    return f"file:{os.path.abspath(video_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def job_key(source: str, transcript_id: str = None, options: dict = None) -> str:
+    """按输入标识（URL / 内容哈希 / transcript_id）与处理参数生成任务去重键"""
+    raw = json.dumps(
+        {"source": source, "transcript_id": transcript_id, "options": options or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# 进程内请求合并：相同 key 的并发请求共享同一次执行的结果
+class SingleFlight:
+    def __init__(self):
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def inflight(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def do(self, key: str, fn) -> tuple[object, bool]:
+        """
+        执行协程函数 fn，若已有相同 key 的执行则直接等待其结果
+
+        Returns:
+            (结果, 是否与其他请求共享)
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if task is None:
+            # 独立的 Task：发起请求的客户端断开连接时，其他等待者的执行不受影响
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+
+            def _done(t: asyncio.Task):
+                self._inflight.pop(key, None)
+                # 取走异常，避免所有等待者都已断开时出现 "exception was never retrieved"
+                if not t.cancelled():
+                    t.exception()
+
+            task.add_done_callback(_done)
+        return await asyncio.shield(task), shared
@@ -0,0 +1,164 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# 轻量的任务级链路追踪：每个任务一个 trace，阶段 / 上游调用为嵌套的 span
+# 导出为 OTLP/JSON（可导入 Jaeger / Tempo 等）或 Chrome trace-event（chrome://tracing、Perfetto）
+
+SERVICE_NAME = "videotingyi"
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") == "1"
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar(
+    "current_trace", default=None
+)
+_current_span: contextvars.ContextVar = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Span:
+    __slots__ = (
+        "name",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "end_ns",
+        "thread_id",
+        "attributes",
+        "error",
+    )
+
+    def __init__(self, name, parent_id, attributes):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.thread_id = threading.get_ident()
+        self.attributes = attributes
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class Trace:
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_otlp(self) -> dict:
+        def attr(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = []
+        for s in self.spans:
+            item = {
+                "traceId": self.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns),
+                "attributes": [attr(k, v) for k, v in s.attributes.items()],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            }
+            if s.parent_id:
+                item["parentSpanId"] = s.parent_id
+            spans.append(item)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": [attr("service.name", SERVICE_NAME)]},
+                    "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+                }
+            ]
+        }
+
+    def to_chrome(self) -> dict:
+        # 每个线程一条时间线，并行的 LLM 调用与空闲等待一目了然
+        pid = os.getpid()
+        events = []
+        for s in self.spans:
+            args = dict(s.attributes)
+            if s.error:
+                args["error"] = s.error
+            events.append(
+                {
+                    "name": s.name,
+                    "ph": "X",
+                    "ts": s.start_ns / 1000,
+                    "dur": (s.end_ns - s.start_ns) / 1000,
+                    "pid": pid,
+                    "tid": s.thread_id,
+                    "args": args,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, job_dir: str):
+        with open(os.path.join(job_dir, "trace.otlp.json"), "w", encoding="utf-8") as f:
+            json.dump(self.to_otlp(), f, ensure_ascii=False)
+        with open(
+            os.path.join(job_dir, "trace.chrome.json"), "w", encoding="utf-8"
+        ) as f:
+            json.dump(self.to_chrome(), f, ensure_ascii=False)
+
+
+@contextmanager
+def start_trace(trace_id: str = None):
+    """开启一个任务级 trace，期间（含 contextvars 传递到的线程）创建的 span 都归属于它"""
+    trace = Trace(trace_id) if TRACE_ENABLED else None
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """记录一个 span；当前没有 trace 时不做任何事"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_span.get()
+    s = Span(name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end_ns = time.time_ns()
+        _current_span.reset(token)
+        trace.add(s)
+
+
+def load_trace(job_dir: str, fmt: str = "otlp") -> dict | None:
+    path = os.path.join(job_dir, f"trace.{fmt}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
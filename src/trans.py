@@ -1,5 +1,11 @@
 import assemblyai as aai
 from utils import download_file,cal_subtitle_size
+from linebreak import get_metrics, line_capacity, line_width, split_at_pauses
+from metrics import stage, counter, STAGE_BYTES, LLM_TOKENS, UPSTREAM_CALLS
+from tracing import span
+import upstream
+from hedge import get_hedger
+from llm_batch import LLM_BATCH, BATCH_TOKENS, estimate_tokens, get_batch_scheduler
 import requests
 import json
 from pathlib import Path
@@ -8,28 +14,153 @@ from openai import OpenAI
 from jinja2 import Template
 
 
+# 单次 LLM 调用的超时（秒），超时按可重试错误处理
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# 模型列表：https://help.aliyun.com/zh/model-studio/getting-started/models
+LLM_MODEL = "qwen-plus"
+# 对冲请求使用的备用服务（必须设置，否则不对冲）与模型（默认与主请求相同）
+LLM_HEDGE_BASE_URL = os.getenv("LLM_HEDGE_BASE_URL")
+LLM_HEDGE_KEY = os.getenv("LLM_HEDGE_KEY")
+LLM_HEDGE_MODEL = os.getenv("LLM_HEDGE_MODEL", LLM_MODEL)
+
+
+# 翻译结果缺段时，只针对缺失的段重新请求的最多轮数
+TRANSLATE_REPAIR_ROUNDS = int(os.getenv("TRANSLATE_REPAIR_ROUNDS", "2"))
+
+UNTRANSLATED_SEGMENTS = counter(
+    "videotingyi_translate_untranslated_segments", "重试后仍未翻译、保留原文的段数"
+)
+
+
+def parse_json_items(content) -> list:
+    """宽松解析 LLM 返回的 JSON 数组
+
+    整体无法解析时（多余文字、代码块标记、输出被截断等）逐个解析数组中的对象，
+    跳过损坏的部分，保留所有完整的元素
+    """
+    if not isinstance(content, str):
+        return []
+    try:
+        value = json.loads(content)
+    except ValueError:
+        value = None
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        # 个别模型会把数组包在某个字段里
+        for v in value.values():
+            if isinstance(v, list):
+                return v
+        return [value]
+    decoder = json.JSONDecoder()
+    items = []
+    pos = max(content.find("["), 0)
+    while True:
+        pos = content.find("{", pos)
+        if pos < 0:
+            return items
+        try:
+            value, pos = decoder.raw_decode(content, pos)
+        except ValueError:
+            pos += 1
+            continue
+        items.append(value)
+
+
+def assign_translations(items: list, pending: list[int], texts) -> dict[int, str]:
+    """把解析出的元素对应到请求的下标：带 id 的按 id；都不带 id 且数量一致时按位置
+
+    id 重复、不在本次请求中、缺少译文或原文非空而译文为空的元素视为缺失
+    """
+    expected = set(pending)
+    with_ids = [
+        it for it in items if isinstance(it, dict) and isinstance(it.get("id"), int)
+    ]
+    if with_ids:
+        pairs = [(it["id"], it.get("text")) for it in with_ids]
+    elif len(items) == len(pending):
+        pairs = [
+            (i, it.get("text") if isinstance(it, dict) else None)
+            for i, it in zip(pending, items)
+        ]
+    else:
+        return {}
+    counts = {}
+    for i, _ in pairs:
+        counts[i] = counts.get(i, 0) + 1
+    result = {}
+    for i, text in pairs:
+        if i not in expected or counts[i] > 1 or not isinstance(text, str):
+            continue
+        if not text.strip() and texts[i]["text"].strip():
+            continue
+        result[i] = text
+    return result
+
+
+def _is_json(content) -> bool:
+    try:
+        json.loads(content)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
 # 视频转录为音频文字
 class Transcriber:
     def __init__(self, api_key: str):
         aai.settings.api_key = api_key
+        # 可指向兼容的本地服务（如 bench/fake_backends.py），用于压测与基准测试
+        base_url = os.getenv("ASSEMBLYAI_BASE_URL")
+        if base_url:
+            aai.settings.base_url = base_url
+        polling_interval = os.getenv("ASSEMBLYAI_POLLING_INTERVAL")
+        if polling_interval:
+            aai.settings.polling_interval = float(polling_interval)
+        # 开启语言检测，返回的 language_code 用于判断是否需要翻译
         config = aai.TranscriptionConfig(
-            speech_models=["universal"], speaker_labels=True
+            speech_models=["universal"], speaker_labels=True, language_detection=True
         )
         self._transcriber = aai.Transcriber(config=config)
 
     def exec(
-        self, video_path: str, transcript_id: str = None
+        self, video_path: str, transcript_id: str = None, temp_dir: str = None
     ) -> tuple[aai.Transcript, str]:
         # 如果是URL则下载
         video_path = video_path
         if video_path.startswith("http"):
-            video_path = download_file(video_path)
-        if transcript_id is None:
-            transcript = self._transcriber.transcribe(video_path)
-        else:
-            transcript = aai.Transcript.get_by_id(transcript_id)
+            video_path = download_file(video_path, temp_dir)
+        op = "transcribe" if transcript_id is None else "get_by_id"
+        try:
+            with stage("asr"):
+                if transcript_id is None:
+                    size = os.path.getsize(video_path)
+                    STAGE_BYTES.observe(size, stage="asr_upload")
+                    # 上传、提交、轮询分开记录，便于区分网络上传与排队 / 识别耗时
+                    with span("asr_upload", bytes=size):
+                        audio_url = upstream.call(
+                            "assemblyai",
+                            "upload",
+                            self._transcriber.upload_file,
+                            video_path,
+                        )
+                    with span("asr_submit"):
+                        transcript = upstream.call(
+                            "assemblyai", "submit", self._transcriber.submit, audio_url
+                        )
+                    with span("asr_poll", transcript_id=transcript.id):
+                        transcript = transcript.wait_for_completion()
+                else:
+                    transcript = upstream.call(
+                        "assemblyai", "get_by_id", aai.Transcript.get_by_id, transcript_id
+                    )
+        except Exception:
+            UPSTREAM_CALLS.inc(service="assemblyai", op=op, outcome="error")
+            raise
         if transcript.status == "error":
+            UPSTREAM_CALLS.inc(service="assemblyai", op=op, outcome="error")
             raise RuntimeError(f"Transcription failed: {transcript.error}")
+        UPSTREAM_CALLS.inc(service="assemblyai", op=op, outcome="success")
         return transcript, video_path
 
     def search_his(
@@ -70,10 +201,25 @@ class CozeTranslator:
 
 class OpenaiTranslator:
     def __init__(self, base_url, api_key, video_path):
+        # 重试由 upstream.call 统一处理（退避、Retry-After、自适应并发），关闭 SDK 自带重试
         self.client = OpenAI(
             api_key=api_key,
             base_url=base_url,
+            max_retries=0,
+            timeout=LLM_TIMEOUT,
         )
+        # 对冲请求走独立的备用服务与并发限制；未配置备用服务时不对冲，
+        # 否则对冲会与主请求排同一个限流队列，在上游饱和时进一步加压
+        self.hedger = get_hedger() if LLM_HEDGE_BASE_URL else None
+        if self.hedger is not None:
+            self.hedge_client = OpenAI(
+                api_key=LLM_HEDGE_KEY or api_key,
+                base_url=LLM_HEDGE_BASE_URL,
+                max_retries=0,
+                timeout=LLM_TIMEOUT,
+            )
+        # 批处理按上游配置分组：服务地址与模型相同的翻译器发出的请求才会合并
+        self.batch_group = (str(base_url), LLM_MODEL)
         subtitle_size = cal_subtitle_size(video_path)
         self.video_width=subtitle_size.video_dim.width
         self.video_height=subtitle_size.video_dim.height
@@ -87,6 +233,8 @@ class OpenaiTranslator:
             self.split_text_llm_cfg = json.load(f)
         with open(translate_llm_cfg_filepath, "r", encoding="utf-8") as f:
             self.translate_llm_cfg = json.load(f)
+        self.translate_messages = []
+        self.split_messages = []
 
     def get_config_filepath(self, config_name: str):
         # 获取当前脚本所在目录
@@ -94,25 +242,75 @@ class OpenaiTranslator:
         file_path = os.path.sep.join([str(script_dir), "config", config_name])
         return file_path
 
-    def chat(self, messages: list):
-        completion = self.client.chat.completions.create(
-            # 模型列表：https://help.aliyun.com/zh/model-studio/getting-started/models
-            model="qwen-plus",
+    def _complete(self, service, client, model, messages, op, on_slot=None):
+        observe = None
+        if self.hedger is not None:
+            # 对冲阈值只看单次请求耗时
+            observe = lambda seconds: self.hedger.record(op, seconds)
+        return upstream.call(
+            service,
+            op,
+            client.chat.completions.create,
+            model=model,
             messages=messages,
+            observe=observe,
+            on_slot=on_slot,
         )
+
+    def chat(self, messages: list, op: str = "chat"):
+        try:
+            with span("llm_call", op=op) as s:
+                if self.hedger is None:
+                    completion = self._complete(
+                        "llm", self.client, LLM_MODEL, messages, op
+                    )
+                else:
+                    # 超过 p95 未返回时对冲，先返回合法 JSON 的一方胜出
+                    completion = self.hedger.run(
+                        op,
+                        lambda on_slot: self._complete(
+                            "llm", self.client, LLM_MODEL, messages, op, on_slot
+                        ),
+                        lambda: self._complete(
+                            "llm_hedge",
+                            self.hedge_client,
+                            LLM_HEDGE_MODEL,
+                            messages,
+                            op,
+                        ),
+                        lambda c: _is_json(c.choices[0].message.content),
+                    )
+                if s is not None and completion.usage is not None:
+                    s.set_attribute("prompt_tokens", completion.usage.prompt_tokens)
+                    s.set_attribute(
+                        "completion_tokens", completion.usage.completion_tokens
+                    )
+        except Exception:
+            UPSTREAM_CALLS.inc(service="llm", op=op, outcome="error")
+            raise
+        UPSTREAM_CALLS.inc(service="llm", op=op, outcome="success")
+        if completion.usage is not None:
+            LLM_TOKENS.observe(completion.usage.prompt_tokens, op=op, kind="prompt")
+            LLM_TOKENS.observe(
+                completion.usage.completion_tokens, op=op, kind="completion"
+            )
         # print(completion.model_dump_json())
         return completion.choices[0].message.content
 
+    def max_length(self) -> int:
+        # 与字幕断行使用同一套字宽：一行能容纳的全角字数
+        return line_capacity(self.video_width, get_metrics(self.font_size))
+
     def split(self, translated_text) -> list[str]:
-        max_length = self.video_width // self.font_size
-        params = {"text": translated_text, "max_length": max_length}
+        params = {"text": translated_text, "max_length": self.max_length()}
         system_message = Template(self.split_text_llm_cfg["sp"]).render(**params)
         user_message = Template(self.split_text_llm_cfg["up"]).render(**params)
         messages = self.split_messages
         messages = self.set_system_message(messages, system_message)
         messages = self.set_user_message(messages, user_message)
         try:
-            result = self.chat(messages)
+            with stage("llm_split"):
+                result = self.chat(messages, op="split")
             result_json= json.loads(result)
             return result_json["split_sentences"]
         except Exception as e:
@@ -120,31 +318,91 @@ class OpenaiTranslator:
             return []
 
     def translate(self, texts) -> list[str]:
-        params = {"text": texts}
-        system_message = Template(self.translate_llm_cfg["sp"]).render(**params)
-        user_message = Template(self.translate_llm_cfg["up"]).render(**params)
-        messages = self.translate_messages
-        messages = self.set_system_message(messages, system_message)
-        messages = self.set_user_message(messages, user_message)
-        try:
-            result = self.chat(messages)
-            result_json= json.loads(result)
-            return result_json
-        except Exception as e:
-            print(str(e))
-            return texts
+        if LLM_BATCH and estimate_tokens(texts) * 2 <= BATCH_TOKENS:
+            # 小任务的翻译与其他任务合并为一个请求（按组隔离上下文）
+            future = get_batch_scheduler().submit(
+                "translate",
+                None,
+                texts,
+                lambda: self._translate(texts),
+                self.chat,
+                self.batch_group,
+            )
+            with span("llm_batch_wait", kind="translate"):
+                return future.result()
+        return self._translate(texts)
 
-    def exec(self, texts):
-        self.translate_messages = []
-        self.split_messages = []
+    def _translate(self, texts) -> list[str]:
+        """逐段带 id 请求翻译；解析出错或缺段时只对缺失的段重新请求，仍失败的段保留原文"""
+        translated = {}
+        pending = list(range(len(texts)))
+        for attempt in range(1 + TRANSLATE_REPAIR_ROUNDS):
+            if not pending:
+                break
+            items = [{"id": i, "text": texts[i]["text"]} for i in pending]
+            params = {"text": json.dumps(items, ensure_ascii=False)}
+            system_message = Template(self.translate_llm_cfg["sp"]).render(**params)
+            user_message = Template(self.translate_llm_cfg["up"]).render(**params)
+            messages = self.translate_messages
+            messages = self.set_system_message(messages, system_message)
+            messages = self.set_user_message(messages, user_message)
+            op = "translate" if attempt == 0 else "translate_repair"
+            try:
+                with stage("llm_translate"):
+                    result = self.chat(messages, op=op)
+            except Exception as e:
+                # 上游调用已在 upstream.call 中重试过
+                print(str(e))
+                break
+            got = assign_translations(parse_json_items(result), pending, texts)
+            translated.update(got)
+            pending = [i for i in pending if i not in got]
+            if pending and attempt < TRANSLATE_REPAIR_ROUNDS:
+                print(f"翻译结果缺少 {len(pending)} 段，重新请求这些段")
+        if pending:
+            UNTRANSLATED_SEGMENTS.inc(len(pending))
+            print(f"{len(pending)} 段翻译失败，保留原文")
+        return [{"text": translated.get(i, t["text"])} for i, t in enumerate(texts)]
+
+    def split_all(self, translated_texts) -> list[dict]:
+        if LLM_BATCH:
+            # 各段拆分请求交给批处理调度器，与本任务及其他任务的请求合并发送
+            scheduler = get_batch_scheduler()
+            max_length = self.max_length()
+            futures = [
+                scheduler.submit(
+                    "split",
+                    max_length,
+                    tt.get("text", "") if isinstance(tt, dict) else tt,
+                    lambda tt=tt: self.split(tt),
+                    self.chat,
+                    self.batch_group,
+                )
+                for tt in translated_texts
+            ]
+            with span("llm_batch_wait", kind="split", requests=len(futures)):
+                return [{"split_sentences": f.result()} for f in futures]
         result = []
-        self.translated_texts = self.translate(texts)
-        for tt in self.translated_texts:
+        for tt in translated_texts:
             split_sentences = self.split(tt)
             obj = {"split_sentences": split_sentences}
             result.append(obj)
         return result
 
+    def split_local(self, text) -> list[str]:
+        """本地按停顿与显示宽度拆分（源语言已是中文、无需翻译时代替 LLM 拆分）"""
+        metrics = get_metrics(self.font_size)
+        return split_at_pauses(text, line_width(self.video_width), metrics.char_width)
+
+    def split_all_local(self, texts) -> list[dict]:
+        return [{"split_sentences": self.split_local(t["text"])} for t in texts]
+
+    def exec(self, texts):
+        self.translate_messages = []
+        self.split_messages = []
+        self.translated_texts = self.translate(texts)
+        return self.split_all(self.translated_texts)
+
     def set_system_message(self, messages: list, system_message: str) -> list:
         handled_messages = [m for m in messages if m["role"] != "system"]
         handled_messages.insert(0, {"role": "system", "content": system_message})
@@ -0,0 +1,201 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+from metrics import counter, gauge
+
+# 上游服务（LLM、ASR）调用的自适应并发与重试
+# 并发上限按 AIMD 调整：延迟正常的成功调用每轮加 1，遇到 429 / 5xx / 超时减半；
+# 可重试的错误按带抖动的指数退避重试，服务端给出 Retry-After 时至少等待该时长
+
+MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "4"))
+BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "1"))
+BACKOFF_CAP = float(os.getenv("UPSTREAM_BACKOFF_CAP", "30"))
+# 延迟超过长期均值的倍数时视为拥塞前兆，不再增加并发
+LATENCY_TOLERANCE = 2.0
+LATENCY_ALPHA = 0.05
+# 两次减半之间至少间隔的时间，避免同一波错误把上限连续砍到底
+DECREASE_COOLDOWN = 1.0
+# 服务 -> (初始, 最小, 最大) 并发
+LIMITS = {
+    "llm": (
+        int(os.getenv("LLM_CONCURRENCY_INITIAL", "4")),
+        1,
+        int(os.getenv("LLM_CONCURRENCY_MAX", "32")),
+    ),
+    "assemblyai": (
+        int(os.getenv("ASR_CONCURRENCY_INITIAL", "2")),
+        1,
+        int(os.getenv("ASR_CONCURRENCY_MAX", "8")),
+    ),
+}
+
+CONCURRENCY_LIMIT = gauge(
+    "videotingyi_upstream_concurrency_limit", "上游调用当前的并发上限", ["service"]
+)
+UPSTREAM_INFLIGHT = gauge(
+    "videotingyi_upstream_inflight", "上游调用在途数", ["service"]
+)
+UPSTREAM_REJECTIONS = counter(
+    "videotingyi_upstream_rejections",
+    "上游拒绝或失败的调用次数（限流、服务端错误、超时）",
+    ["service", "reason"],
+)
+UPSTREAM_RETRIES = counter("videotingyi_upstream_retries", "上游调用重试次数", ["service", "op"])
+
+
+class RetryableError(Exception):
+    """需要退避重试的上游错误"""
+
+    def __init__(self, reason: str, retry_after: float = None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def _status_code(e: Exception):
+    code = getattr(e, "status_code", None)
+    if code is None:
+        code = getattr(getattr(e, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def _retry_after(e: Exception):
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify(e: Exception) -> str | None:
+    """返回可重试错误的原因（throttled / server_error / timeout），不可重试时返回 None"""
+    if isinstance(e, RetryableError):
+        return e.reason
+    if isinstance(e, TimeoutError) or "Timeout" in type(e).__name__:
+        return "timeout"
+    if "Connection" in type(e).__name__:
+        return "connection"
+    code = _status_code(e)
+    if code == 429:
+        return "throttled"
+    if code is not None and code >= 500:
+        return "server_error"
+    return None
+
+
+class AdaptiveLimiter:
+    def __init__(self, service: str, initial: int, minimum: int, maximum: int):
+        self.service = service
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.inflight = 0
+        self.latency = None  # 成功调用延迟的长期均值
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        CONCURRENCY_LIMIT.set(int(self.limit), service=service)
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+        UPSTREAM_INFLIGHT.inc(service=self.service)
+        start = time.monotonic()
+        outcome = {"ok": False, "reason": None}
+        try:
+            yield outcome
+        finally:
+            UPSTREAM_INFLIGHT.dec(service=self.service)
+            self._release(outcome, time.monotonic() - start)
+
+    def _release(self, outcome: dict, latency: float):
+        with self._cond:
+            self.inflight -= 1
+            if outcome["ok"]:
+                healthy = (
+                    self.latency is None or latency <= self.latency * LATENCY_TOLERANCE
+                )
+                self.latency = (
+                    latency
+                    if self.latency is None
+                    else self.latency + LATENCY_ALPHA * (latency - self.latency)
+                )
+                if healthy:
+                    # 加性增：每轮（约 limit 次成功）加 1
+                    self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif outcome["reason"] is not None:
+                now = time.monotonic()
+                if now - self._last_decrease >= DECREASE_COOLDOWN:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+            CONCURRENCY_LIMIT.set(int(self.limit), service=self.service)
+            self._cond.notify_all()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(service: str) -> AdaptiveLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(service)
+        if limiter is None:
+            initial, minimum, maximum = LIMITS.get(service, (4, 1, 32))
+            limiter = _limiters[service] = AdaptiveLimiter(
+                service, initial, minimum, maximum
+            )
+        return limiter
+
+
+def backoff(attempt: int, retry_after: float = None) -> float:
+    """第 attempt 次重试前的等待时间（full jitter），不短于 Retry-After"""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def call(service: str, op: str, fn, *args, observe=None, on_slot=None, **kwargs):
+    """在自适应并发上限内调用 fn，可重试的错误退避重试，重试用尽或不可重试时抛出最后一次的异常
+
+    observe(秒) 接收单次成功调用的耗时：从取得并发名额开始计时，不含排队与重试退避；
+    on_slot() 在每次取得并发名额、发出请求前调用（对冲计时从这里开始）
+    """
+    limiter = get_limiter(service)
+    for attempt in range(MAX_ATTEMPTS):
+        with limiter.slot() as outcome:
+            if on_slot is not None:
+                on_slot()
+            try:
+                start = time.monotonic()
+                result = fn(*args, **kwargs)
+                outcome["ok"] = True
+                if observe is not None:
+                    observe(time.monotonic() - start)
+                return result
+            except Exception as e:
+                reason = classify(e)
+                outcome["reason"] = reason
+                if reason is None:
+                    raise
+                UPSTREAM_REJECTIONS.inc(service=service, reason=reason)
+                if attempt + 1 >= MAX_ATTEMPTS:
+                    raise
+                retry_after = getattr(e, "retry_after", None) or _retry_after(e)
+        delay = backoff(attempt, retry_after)
+        UPSTREAM_RETRIES.inc(service=service, op=op)
+        print(f"{service} {op} 调用失败（{reason}），{delay:.1f}s 后第 {attempt + 1} 次重试")
+        time.sleep(delay)
@@ -1,12 +1,15 @@
 import os
 import requests
-import uuid
-from datetime import datetime
-import re
+from bisect import bisect_left, bisect_right
 import ffmpeg
+from dataclasses import dataclass
 from pydantic import BaseModel
 from typing import Optional
 from s3 import S3Operator
+from workspace import get_workspace
+from metrics import stage, STAGE_BYTES
+from columnar import TranscriptColumns
+from linebreak import split_at_pauses
 
 
 class SubtitleData(BaseModel):
@@ -15,6 +18,30 @@ class SubtitleData(BaseModel):
     end: int
     font_color: Optional[str] = "#FF0000"
     font_size: Optional[int] = 10
+    speaker: Optional[str] = None
+
+
+@dataclass(slots=True)
+class Cue:
+    """流水线内部使用的字幕条目，字段与 SubtitleData 一致但不做校验；
+    检查点保存 to_dict() 的结果，接口响应再经 SubtitleData 校验输出（见 main.serialize_result）"""
+
+    text: str
+    start: int
+    end: int
+    font_color: Optional[str] = "#FF0000"
+    font_size: Optional[int] = 10
+    speaker: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "text": self.text,
+            "start": self.start,
+            "end": self.end,
+            "font_color": self.font_color,
+            "font_size": self.font_size,
+            "speaker": self.speaker,
+        }
 
 
 class VideoDimension(BaseModel):
@@ -33,18 +60,9 @@ def modify_separator(path, new_sep="/") -> str:
     return path
 
 
-def create_tempdir():
-    # 生成带时间戳的文件夹名称
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    uuid_short = uuid.uuid4().hex[:8]
-    temp_dir_name = f"{timestamp}_{uuid_short}"
-
-    # 在当前目录下创建临时文件夹
-    temp_dir = os.path.join(".", "temp", temp_dir_name)
-
-    # 创建临时文件夹
-    os.makedirs(temp_dir, exist_ok=True)
-    return temp_dir
+def create_tempdir(job_id=None):
+    # 由工作目录管理器统一分配，受配额与 TTL 约束
+    return get_workspace().create(job_id)
 
 
 def download_file(url, temp_dir=None) -> str:
@@ -54,73 +72,33 @@ def download_file(url, temp_dir=None) -> str:
     local_path = os.path.join(temp_dir, os.path.basename(url.split("?")[0]))
 
     print(f"正在下载: {url}")
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-
-    with open(local_path, "wb") as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            if chunk:
-                f.write(chunk)
+    with stage("download"):
+        response = requests.get(url, stream=True)
+        response.raise_for_status()
+
+        with open(local_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                if chunk:
+                    f.write(chunk)
+    STAGE_BYTES.observe(os.path.getsize(local_path), stage="download")
     local_path = modify_separator(local_path)
     print(f"下载完成: {local_path}")
     return local_path
 
 
 def split_sentence_by_dot(json_response):
-    text = json_response.get("text", "")
-    speaker = json_response.get("speaker", "")
-    words = json_response.get("words", [])
-    confidence = json_response.get("confidence", 0)
-    # 分割并保留分隔符
-    pattern = r"(?<!\d\.)(?<!\d)(?<![A-Za-z]\.)([.!?。！？]+)\s*"
-    parts = re.split(pattern, text)
-
-    # 组合句子
-    sentences = []
-    for i in range(0, len(parts) - 1, 2):
-        if parts[i].strip():  # 非空句子
-            sentences.append(parts[i] + parts[i + 1])
-
-    # 处理最后一个部分（如果有）
-    if parts[-1].strip():
-        sentences.append(parts[-1])
-    sentences = [
-        {"text": s.strip(), "words": re.split(r"\s+", s.strip())} for s in sentences
-    ]
-    global_words_idx = 0
-    global_start = 0
-    global_end = 0
-    handled_sentences = []
-    for s in sentences:
-        txt = s.get("text", "")
-        wds = s.get("words", [])
-        handled_wds = []
-        for idx, w in enumerate(wds):
-            global_word = words[global_words_idx]
-            global_word_text = global_word.get("text", "")
-            if w != global_word_text:
-                break
-            global_words_idx += 1
-            handled_wds.append(global_word)
-            if idx == 0:
-                global_start = global_word.get("start", 0)
-            global_end = global_word.get("end", 0)
-        handled_sentences.append(
-            {
-                "speaker": speaker,
-                "text": txt,
-                "confidence": confidence,
-                "start": global_start,
-                "end": global_end,
-                "words": handled_wds,
-            }
-        )
-    return handled_sentences
+    # 传入整份转录（含 utterances）时一次处理所有语句，否则视为单条语句
+    if json_response.get("utterances"):
+        columns = TranscriptColumns.from_response(json_response)
+    else:
+        columns = TranscriptColumns.from_utterances([json_response])
+    return columns.split_sentences().to_dicts()
 
 
 def get_video_dimensions(video_path) -> VideoDimension:
     # 使用ffprobe获取视频信息
-    probe = ffmpeg.probe(video_path)
+    with stage("probe"):
+        probe = ffmpeg.probe(video_path)
     # 查找视频流
     video_stream = None
     for stream in probe["streams"]:
@@ -136,7 +114,75 @@ def get_video_dimensions(video_path) -> VideoDimension:
     return VideoDimension(width=width, height=height)
 
 
-def generate_subtitle_data(utterances, translated_texts) -> list[SubtitleData]:
+def extract_audio(video_path, temp_dir) -> str:
+    """只保留音轨（流复制，不解码也不重新编码），只需要字幕时用它代替视频上传 ASR"""
+    audio_path = os.path.join(temp_dir, "audio.mka")
+    with stage("extract_audio"):
+        ffmpeg.input(video_path).output(
+            audio_path, vn=None, sn=None, acodec="copy"
+        ).run(overwrite_output=True, quiet=True)
+    STAGE_BYTES.observe(os.path.getsize(audio_path), stage="extract_audio")
+    return audio_path
+
+
+def allocate_times(start, end, lengths, words=None) -> list[tuple[int, int]]:
+    """按文本长度把 [start, end] 分配给各个片段，用前缀和一次算出所有起止时间
+
+    传入 words（各词的 (start, end) 序列）时按词的发声时间加权：片段落在说话的时间上，
+    词与词之间的停顿不计入，停顿处的片段边界会留出空隙
+    """
+    total = sum(lengths)
+    if not total:
+        return []
+    prefix = [0]
+    for n in lengths:
+        prefix.append(prefix[-1] + n)
+
+    spoken = [(s, e) for s, e in words or () if e > s]
+    if not spoken:
+        span = end - start
+        result = []
+        for i, n in enumerate(lengths):
+            start_s = round(start + span * (prefix[i] / total))
+            result.append((start_s, round(start_s + span * (n / total))))
+        return result
+
+    # 发声时间的前缀和：speech[k] 为前 k 个词的累计时长
+    speech = [0]
+    for s, e in spoken:
+        speech.append(speech[-1] + e - s)
+
+    def to_time(position, side):
+        k = max(1, min(len(spoken), side(speech, position)))
+        s, e = spoken[k - 1]
+        return round(min(e, s + position - speech[k - 1]))
+
+    result = []
+    for i in range(len(lengths)):
+        # 起点落在下一个词的开头，终点落在上一个词的结尾
+        begin = to_time(speech[-1] * prefix[i] / total, bisect_right)
+        finish = to_time(speech[-1] * prefix[i + 1] / total, bisect_left)
+        result.append((begin, max(begin, finish)))
+    return result
+
+
+def _segment_times(utterances, with_words):
+    """逐条给出 (说话人, 开始, 结束, 词时间)；列式存储直接读数组，不还原为 dict"""
+    if isinstance(utterances, TranscriptColumns):
+        for i in range(len(utterances)):
+            yield utterances.segment_times(i, with_words)
+        return
+    for u in utterances:
+        words = None
+        if with_words:
+            words = ((w.get("start", 0), w.get("end", 0)) for w in u.get("words") or ())
+        yield u.get("speaker", ""), u.get("start", 0), u.get("end", 0), words
+
+
+def generate_subtitle_data(
+    utterances, translated_texts, weight_by_words=False
+) -> list[Cue]:
+    """utterances 为 TranscriptColumns 或 AssemblyAI 风格的 dict 列表"""
     speaker_colors = {
         "A": "#FFFFFF",  # 白色
         "B": "#FFFF00",  # 黄色
@@ -144,32 +190,31 @@ def generate_subtitle_data(utterances, translated_texts) -> list[SubtitleData]:
     }
     default_color = "#FFFFFF"  # 白色
     subtitles = []
-    for idx, u in enumerate(utterances):
-        speaker = u.get("speaker", "")
+    segments = _segment_times(utterances, weight_by_words)
+    for idx, (speaker, start, end, words) in enumerate(segments):
         font_color = speaker_colors.get(speaker, default_color)
         split_sentences = translated_texts[idx].get("split_sentences", [])
-        total_length = sum(len(s) for s in split_sentences)
-        start = u.get("start", 0)
-        end = u.get("end", 0)
-        for idx2, s in enumerate(split_sentences):
-            begin_rate = sum(len(s2) for s2 in split_sentences[0:idx2]) / total_length
-            len_rate = len(s) / total_length
-            start_s = round(start + (end - start) * begin_rate)
-            end_s = round(start_s + (end - start) * len_rate)
-            subtitle = SubtitleData(
-                text=s, start=start_s, end=end_s, font_size=10, font_color=font_color
-            )
-            subtitles.append(subtitle)
+        times = allocate_times(start, end, [len(s) for s in split_sentences], words)
+        subtitles.extend(
+            Cue(s, start_s, end_s, font_color, 10, speaker)
+            for s, (start_s, end_s) in zip(split_sentences, times)
+        )
     return subtitles
 
 
-def cal_subtitle_size(video_path) -> SubtitleSize:
-    video_dim = get_video_dimensions(video_path)
+def font_size_for_height(height) -> int:
     # 根据视频分辨率计算合适的字体大小
-    base_font_size = int(video_dim.height * 0.05)  # 字体大小为视频高度的百分比
+    base_font_size = int(height * 0.05)  # 字体大小为视频高度的百分比
     if base_font_size < 16:
         base_font_size = 16
-    return SubtitleSize(video_dim=video_dim, font_size=base_font_size)
+    return base_font_size
+
+
+def cal_subtitle_size(video_path) -> SubtitleSize:
+    video_dim = get_video_dimensions(video_path)
+    return SubtitleSize(
+        video_dim=video_dim, font_size=font_size_for_height(video_dim.height)
+    )
 
 
 # 上传输出视频到S3对象存储
@@ -215,6 +260,14 @@ def hex_to_ssa_color(hex_color) -> str:
     return None
 
 
+def hex_to_ssa_style_color(hex_color) -> str:
+    """将十六进制颜色转换为样式行中的SSA颜色 (&HAABBGGRR，不透明)"""
+    color = hex_to_ssa_color(hex_color)
+    if color is None:
+        return None
+    return f"&H00{color[2:-1]}"
+
+
 def split_text_with_punctuation_check(text, chunk_size) -> list[str]:
     """
     按最大长度 chunk_size 分割文本，满足：
@@ -230,68 +283,8 @@ def split_text_with_punctuation_check(text, chunk_size) -> list[str]:
     Returns:
         list[str]: 分割后的文本块列表
     """
-    if chunk_size <= 0:
-        return []
-
-    # 停顿符号集合（不含 '.'，因其需特殊判断）
-    pause_punctuations = set("，；：。、,;: ")
-    normal_punctuation = "?？!！"
-
-    chunks = []
-    current_chunk = ""
-    i = 0
-    n = len(text)
-
-    while i < n:
-        char = text[i]
-
-        # 判断当前字符是否为“应触发分割的停顿符”
-        is_pause = False
-
-        if char in pause_punctuations:
-            is_pause = True
-        elif char == ".":
-            # 检查是否为小数点：前后均为数字
-            prev_is_digit = i > 0 and text[i - 1].isdigit()
-            next_is_digit = i + 1 < n and text[i + 1].isdigit()
-            if prev_is_digit and next_is_digit:
-                # 是小数点，保留，不视为停顿符
-                is_pause = False
-            else:
-                # 不是小数点（如句尾、缩写等），视为停顿符
-                is_pause = True
-
-        if is_pause:
-            # 遇到停顿符：先提交当前块（如果非空）
-            if current_chunk:
-                chunks.append(current_chunk)
-                current_chunk = ""
-            # 跳过该停顿符（不加入任何块）
-            i += 1
-        else:
-            # 普通字符（包括 ? ! ？！和小数点）
-            if len(current_chunk) >= chunk_size:
-                # 当前块已满
-                # 判断下一个字符是否是普通字符
-                if char in normal_punctuation:
-                    current_chunk += char
-                    chunks.append(current_chunk)
-                    current_chunk = ""
-                    i += 1
-                    continue
-                else:
-                    chunks.append(current_chunk)
-                    current_chunk = ""
-
-            # 尝试加入当前字符
-            current_chunk += char
-            i += 1
-
-    # 处理最后一块
-    if current_chunk:
-        chunks.append(current_chunk)
-
-    return chunks
+    # 与字幕断行共用同一套规则，这里按字数计宽
+    return split_at_pauses(text, chunk_size)
 
 
 def split_into_n_segments_int(start, end, n):
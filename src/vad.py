@@ -0,0 +1,161 @@
+import os
+import re
+from bisect import bisect_left, bisect_right
+
+import ffmpeg
+
+from metrics import histogram, stage, STAGE_BYTES
+
+# 上传 ASR 前裁掉音轨中的长静音：ffmpeg silencedetect 找出静音段，只保留有声部分拼接上传，
+# 并记录裁剪后时间到原视频时间的偏移表，转录返回后把词 / 语句时间换算回原时间
+# 判断依据是音量，纯音乐段不会被当作静音
+
+VAD_TRIM = os.getenv("VAD_TRIM", "0") == "1"
+# 低于该音量视为静音
+SILENCE_NOISE_DB = float(os.getenv("VAD_NOISE_DB", "-35"))
+# 静音持续超过该秒数才裁掉
+SILENCE_MIN_SECONDS = float(os.getenv("VAD_MIN_SILENCE", "2"))
+# 有声段前后各保留的余量（秒），避免切掉词首词尾
+SPEECH_PADDING = 0.3
+
+SILENCE_PATTERN = re.compile(r"silence_(start|end): (-?[\d.]+)")
+
+REMOVED_RATIO = histogram(
+    "videotingyi_vad_removed_ratio",
+    "上传 ASR 前裁掉的静音占音频时长的比例",
+    buckets=(0.0, 0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9, 1.0),
+)
+
+
+class OffsetMap:
+    """裁剪后音频时间 -> 原音频时间（毫秒），由保留下来的各段 (裁剪后起点, 原起点, 时长) 组成"""
+
+    __slots__ = ("segments", "_starts")
+
+    def __init__(self, segments: list):
+        self.segments = [tuple(s) for s in segments]
+        self._starts = [s[0] for s in self.segments]
+
+    @classmethod
+    def from_keep(cls, keep: list[tuple[float, float]]) -> "OffsetMap":
+        segments = []
+        position = 0
+        for start, end in keep:
+            original = int(round(start * 1000))
+            length = int(round(end * 1000)) - original
+            segments.append((position, original, length))
+            position += length
+        return cls(segments)
+
+    def to_original(self, ms, end=False) -> int:
+        """结束时间恰好落在两段交界处时归入前一段，开始时间归入后一段"""
+        if not self.segments:
+            return ms
+        if end:
+            i = max(0, bisect_left(self._starts, ms) - 1)
+        else:
+            i = max(0, bisect_right(self._starts, ms) - 1)
+        trimmed, original, length = self.segments[i]
+        return original + min(max(ms - trimmed, 0), length)
+
+
+def audio_duration(audio_path) -> float:
+    return float(ffmpeg.probe(audio_path)["format"]["duration"])
+
+
+def detect_silences(audio_path) -> list[tuple[float, float]]:
+    """silencedetect 输出的静音段（秒）；只解码音频，不编码"""
+    _, stderr = (
+        ffmpeg.input(audio_path)
+        .output(
+            "-",
+            af=f"silencedetect=noise={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_SECONDS}",
+            format="null",
+        )
+        .run(capture_stderr=True)
+    )
+    silences = []
+    start = None
+    for kind, value in SILENCE_PATTERN.findall(stderr.decode("utf-8", "replace")):
+        if kind == "start":
+            start = max(0.0, float(value))
+        elif start is not None:
+            silences.append((start, float(value)))
+            start = None
+    if start is not None:
+        silences.append((start, float("inf")))
+    return silences
+
+
+def keep_segments(silences, duration: float) -> list[tuple[float, float]]:
+    """静音段的补集，两侧各留 SPEECH_PADDING 余量并合并相邻段"""
+    keep = []
+    cursor = 0.0
+    for start, end in silences:
+        a, b = cursor, min(duration, start + SPEECH_PADDING)
+        if b > a:
+            keep.append((a, b))
+        cursor = max(cursor, end - SPEECH_PADDING)
+    if cursor < duration:
+        keep.append((cursor, duration))
+    merged = []
+    for a, b in keep:
+        if merged and a <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+        else:
+            merged.append((a, b))
+    return merged
+
+
+def trim_audio(audio_path, keep, output_path) -> str:
+    """只保留 keep 中的时间段并首尾相接（单声道 AAC，足够 ASR 使用）"""
+    expr = "+".join(f"between(t,{a:.3f},{b:.3f})" for a, b in keep)
+    ffmpeg.input(audio_path).output(
+        output_path,
+        af=f"aselect='{expr}',asetpts=N/SR/TB",
+        ac=1,
+        acodec="aac",
+        audio_bitrate="64k",
+        vn=None,
+    ).run(overwrite_output=True, quiet=True)
+    return output_path
+
+
+def trim_silence(audio_path, temp_dir) -> tuple[str, OffsetMap, dict]:
+    """返回 (上传用的音频路径, 偏移表, 裁剪统计)；静音很少时不裁剪，原样返回"""
+    with stage("vad"):
+        duration = audio_duration(audio_path)
+        keep = keep_segments(detect_silences(audio_path), duration)
+        kept = sum(b - a for a, b in keep)
+        removed = 1 - kept / duration if duration > 0 else 0.0
+        report = {
+            "original_seconds": round(duration, 3),
+            "trimmed_seconds": round(kept, 3),
+            "removed_fraction": round(removed, 4),
+        }
+        REMOVED_RATIO.observe(removed)
+        if not keep or removed < 0.01:
+            return audio_path, OffsetMap([]), report
+        output_path = os.path.join(temp_dir, "audio_trimmed.m4a")
+        trim_audio(audio_path, keep, output_path)
+    STAGE_BYTES.observe(os.path.getsize(output_path), stage="vad_output")
+    print(f"裁掉静音 {removed:.1%}（{duration:.1f}s -> {kept:.1f}s）")
+    return output_path, OffsetMap.from_keep(keep), report
+
+
+def remap_transcript(json_response: dict, offsets: OffsetMap) -> dict:
+    """把转录结果中词与语句的时间换算回原视频时间（原地修改）"""
+    if not offsets.segments:
+        return json_response
+
+    def remap(item):
+        item["start"] = offsets.to_original(item.get("start", 0))
+        item["end"] = offsets.to_original(item.get("end", 0), end=True)
+
+    for w in json_response.get("words") or []:
+        remap(w)
+    for u in json_response.get("utterances") or []:
+        remap(u)
+        for w in u.get("words") or []:
+            remap(w)
+    return json_response
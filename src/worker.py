@@ -0,0 +1,131 @@
+import os
+import signal
+import socket
+import threading
+import traceback
+import multiprocessing
+
+from dotenv import load_dotenv
+
+from jobqueue import get_job_queue
+from pipeline import run_pipeline
+from workspace import get_workspace
+from metrics import serve_metrics
+
+load_dotenv()
+
+
+class Worker:
+    def __init__(self, poll_interval: float = 1.0):
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.queue = get_job_queue()
+        self.workspace = get_workspace()
+        self._stop_event = threading.Event()
+
+    def stop(self, *args):
+        # 收到退出信号后不再领取新任务，当前任务执行完再退出
+        self._stop_event.set()
+
+    def _heartbeat_loop(self, job_id: str, done: threading.Event):
+        interval = self.queue.lease_seconds / 3
+        while not done.wait(interval):
+            self.queue.heartbeat(job_id, self.worker_id)
+
+    def run_job(self, job: dict):
+        payload = job["payload"]
+        job_dir = payload.get("job_dir")
+        if job_dir:
+            self.workspace.acquire(job_dir)
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat_loop, args=(job["id"], done), daemon=True
+        )
+        heartbeat.start()
+        print(f"[{self.worker_id}] 开始处理任务: {job['id']}")
+        try:
+            result = run_pipeline(
+                payload["video_path"],
+                payload.get("transcript_id"),
+                job_dir,
+                payload.get("mode", "full"),
+            )
+            if self.queue.complete(job["id"], self.worker_id, result):
+                print(f"[{self.worker_id}] 任务完成: {job['id']}")
+            else:
+                print(f"[{self.worker_id}] 租约已失效，丢弃结果: {job['id']}")
+        except Exception as e:
+            error_info = {
+                "status": "error",
+                "error_type": type(e).__name__,
+                "error_message": str(e),
+                "traceback": traceback.format_exc(),
+            }
+            if self.queue.fail(job["id"], self.worker_id, error_info, job["attempts"]):
+                print(f"[{self.worker_id}] 任务失败: {job['id']} {e}")
+            else:
+                print(f"[{self.worker_id}] 租约已失效，丢弃错误: {job['id']} {e}")
+        finally:
+            done.set()
+            heartbeat.join()
+            if job_dir:
+                self.workspace.release(job_dir)
+
+    def run(self):
+        print(f"[{self.worker_id}] worker 已启动")
+        while not self._stop_event.is_set():
+            job = self.queue.claim(self.worker_id)
+            if job is None:
+                self._stop_event.wait(self.poll_interval)
+                continue
+            self.run_job(job)
+        print(f"[{self.worker_id}] worker 已退出")
+
+
+def worker_main(poll_interval: float, metrics_port: int = 0):
+    if metrics_port:
+        serve_metrics(metrics_port)
+    worker = Worker(poll_interval)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="转录任务 worker")
+    parser.add_argument(
+        "-n",
+        "--processes",
+        type=int,
+        default=int(os.getenv("WORKER_PROCESSES", "1")),
+        help="worker 进程数 (默认: 1)",
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=1.0, help="队列为空时的轮询间隔（秒）"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.getenv("WORKER_METRICS_PORT", "0")),
+        help="Prometheus 指标端口，多进程时第 i 个进程使用 端口+i (默认: 0 不开启)",
+    )
+    args = parser.parse_args()
+
+    if args.processes <= 1:
+        worker_main(args.poll_interval, args.metrics_port)
+    else:
+        processes = [
+            multiprocessing.Process(
+                target=worker_main,
+                args=(args.poll_interval, args.metrics_port and args.metrics_port + i),
+            )
+            for i in range(args.processes)
+        ]
+        for p in processes:
+            p.start()
+        # 父进程忽略信号，由子进程各自处理后退出
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for p in processes:
+            p.join()
@@ -0,0 +1,412 @@
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+# 活跃标记文件：多进程（API / worker）共享同一根目录时，用它判断目录是否仍在使用
+# 内容为 "主机名 pid"，持有进程定期刷新其修改时间作为心跳
+ACTIVE_MARKER = ".active"
+# 心跳超过该时长未刷新，或同一主机上的持有进程已退出，视为崩溃遗留的标记
+ACTIVE_TIMEOUT = int(os.getenv("WORKSPACE_ACTIVE_TIMEOUT", "600"))
+HOSTNAME = socket.gethostname()
+
+
+def _dir_size(path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# 临时工作目录管理：每个任务一个目录，总量配额 + LRU 淘汰 + TTL 清理
+class WorkspaceManager:
+    def __init__(
+        self,
+        root="./temp",
+        quota_bytes=0,
+        ttl_seconds=0,
+        sweep_interval=60,
+    ):
+        """
+        Args:
+            root: 工作目录根路径，可指向高速盘或 tmpfs（如 /dev/shm/videotingyi）
+            quota_bytes: 总占用上限（字节），0 表示不限制
+            ttl_seconds: 任务结束后目录保留时长（秒），0 表示不过期
+            sweep_interval: 后台清理线程的扫描间隔（秒）
+        """
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        # path -> {"last_access": float, "size": int, "active": bool}
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        # 占用字节数与活跃目录数随增删增量维护，stats() 不再遍历目录树
+        self._bytes = 0
+        self._active = 0
+        # 本进程持有活跃标记的目录，由心跳线程定期刷新
+        self._owned = set()
+        # 已摘除跟踪、正在锁外删除的目录
+        self._removing = set()
+        self._heartbeat = None
+        self._evicted_total = 0
+        self._expired_total = 0
+        self._sweeper = None
+        self._stop_event = threading.Event()
+        os.makedirs(self.root, exist_ok=True)
+        self._discover()
+
+    # 遍历目录树、删除目录等文件 IO 都在锁外进行：锁内只做快照与计数更新，
+    # 后台清理期间 create / touch / stats 等调用不会被阻塞
+
+    def _discover(self):
+        # 接管上次运行遗留或其他进程创建的目录，按修改时间排序进入 LRU
+        with self._lock:
+            known = set(self._entries) | self._removing
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if path in known:
+                continue
+            try:
+                if os.path.isdir(path):
+                    found.append(
+                        (os.path.getmtime(path), path, _dir_size(path), self.is_active(path))
+                    )
+            except OSError:
+                pass
+        gone = [p for p in known if not os.path.isdir(p)]
+        with self._lock:
+            # 新发现的目录按修改时间插到 LRU 头部（越旧越靠前）
+            for mtime, path, size, active in sorted(found, reverse=True):
+                if path in self._entries or path in self._removing:
+                    continue
+                self._track(path, mtime, size, active)
+                self._entries.move_to_end(path, last=False)
+            # 已被其他进程删除的目录不再跟踪
+            for path in gone:
+                if path not in self._owned:
+                    self._untrack(path)
+
+    def _track(self, path, last_access, size, active):
+        """加入或更新跟踪（调用方持有锁），同时维护总量"""
+        self._untrack(path)
+        self._entries[path] = {"last_access": last_access, "size": size, "active": active}
+        self._bytes += size
+        self._active += active
+
+    def _untrack(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._bytes -= entry["size"]
+            self._active -= entry["active"]
+        return entry
+
+    def _set_size(self, entry, size):
+        self._bytes += size - entry["size"]
+        entry["size"] = size
+
+    def _set_active(self, entry, active):
+        self._active += active - entry["active"]
+        entry["active"] = active
+
+    def is_active(self, path) -> bool:
+        """目录带有未过期的活跃标记；崩溃进程遗留的标记视为无效"""
+        marker = os.path.join(path, ACTIVE_MARKER)
+        try:
+            mtime = os.path.getmtime(marker)
+            with open(marker, "r", encoding="utf-8") as f:
+                owner = f.read().split()
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return True
+        if time.time() - mtime > ACTIVE_TIMEOUT:
+            return False
+        if len(owner) == 2 and owner[0] == HOSTNAME and owner[1].isdigit():
+            return _pid_alive(int(owner[1]))
+        return True
+
+    def _mark_active(self, path):
+        with open(os.path.join(path, ACTIVE_MARKER), "w", encoding="utf-8") as f:
+            f.write(f"{HOSTNAME} {os.getpid()}")
+        with self._lock:
+            self._owned.add(path)
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(
+                    target=self._heartbeat_loop, name="workspace-heartbeat", daemon=True
+                )
+                self._heartbeat.start()
+
+    def _owns_marker(self, path) -> bool:
+        try:
+            with open(os.path.join(path, ACTIVE_MARKER), "r", encoding="utf-8") as f:
+                return f.read() == f"{HOSTNAME} {os.getpid()}"
+        except OSError:
+            return False
+
+    def _heartbeat_loop(self):
+        # 刷新本进程持有的活跃标记，间隔为超时的 1/3
+        while True:
+            time.sleep(ACTIVE_TIMEOUT / 3)
+            with self._lock:
+                owned = list(self._owned)
+            handed_off = []
+            for path in owned:
+                # 标记已被其他进程接管（如队列模式下 API 创建、worker 领取的任务目录）或已删除时，
+                # 本进程不再持有该目录，由接管方的心跳负责
+                if not self._owns_marker(path):
+                    handed_off.append(path)
+                    continue
+                try:
+                    os.utime(os.path.join(path, ACTIVE_MARKER))
+                except OSError:
+                    pass
+            if handed_off:
+                with self._lock:
+                    self._owned.difference_update(handed_off)
+
+    def create(self, job_id=None) -> str:
+        # 生成带时间戳的文件夹名称
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        suffix = job_id or uuid.uuid4().hex[:8]
+        path = os.path.join(self.root, f"{timestamp}_{suffix}")
+        os.makedirs(path, exist_ok=True)
+        self._mark_active(path)
+        with self._lock:
+            self._track(path, time.time(), 0, True)
+        self.enforce_quota()
+        return path
+
+    def acquire(self, path):
+        """重新标记已有目录为使用中（如 worker 领取到由 API 进程创建的任务目录）"""
+        os.makedirs(path, exist_ok=True)
+        self._mark_active(path)
+        with self._lock:
+            entry = self._entries.get(path)
+        size = entry["size"] if entry is not None else _dir_size(path)
+        with self._lock:
+            self._track(path, time.time(), size, True)
+
+    def adopt(self, path, name) -> str:
+        """把本进程持有的目录 path 并入根目录下的目录 name（改名或合并），返回最终目录
+
+        name 已存在（相同输入的上一次任务，含其检查点）时把 path 中的文件移入并复用该目录，
+        否则直接把 path 改名为 name；name 正被其他进程使用时不合并，仍返回 path
+        """
+        target = os.path.join(self.root, name)
+        if target == path:
+            return path
+        if not os.path.isdir(target):
+            try:
+                os.rename(path, target)
+            except OSError:
+                return path
+            with self._lock:
+                entry = self._untrack(path)
+                self._owned.discard(path)
+                self._owned.add(target)
+                self._track(target, time.time(), entry["size"] if entry else 0, True)
+            return target
+        with self._lock:
+            if target in self._owned or target in self._removing:
+                return path
+            # 先占用，检查其他进程的标记期间不会被清理线程删除
+            self._owned.add(target)
+        if self.is_active(target):
+            with self._lock:
+                self._owned.discard(target)
+            return path
+        self.acquire(target)
+        for entry in os.listdir(path):
+            if entry != ACTIVE_MARKER:
+                os.replace(os.path.join(path, entry), os.path.join(target, entry))
+        self.discard(path)
+        return target
+
+    def touch(self, path):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return
+            entry["last_access"] = time.time()
+            self._entries.move_to_end(path)
+
+    def release(self, path):
+        """任务结束：目录保留供下载，之后由 TTL 或配额淘汰（目录可由其他进程创建）"""
+        try:
+            os.unlink(os.path.join(path, ACTIVE_MARKER))
+        except FileNotFoundError:
+            pass
+        # 目录内容已不再变化，只在此统计一次大小
+        size = _dir_size(path)
+        with self._lock:
+            self._owned.discard(path)
+            self._track(path, time.time(), size, False)
+        self.enforce_quota()
+
+    def discard(self, path):
+        """立即删除目录（如任务失败且无需保留中间产物）"""
+        with self._lock:
+            self._owned.discard(path)
+            self._untrack(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+    @contextmanager
+    def job(self, job_id=None):
+        path = self.create(job_id)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+    def _refresh(self):
+        """重新检查各目录的活跃状态，活跃目录内容仍在变化，重新统计大小（只在后台清理时执行）"""
+        with self._lock:
+            paths = list(self._entries)
+        updates = []
+        for path in paths:
+            active = self.is_active(path)
+            updates.append((path, active, _dir_size(path) if active else None))
+        with self._lock:
+            for path, active, size in updates:
+                entry = self._entries.get(path)
+                if entry is None:
+                    continue
+                # 期间被本进程重新占用的目录以最新状态为准
+                self._set_active(entry, active or path in self._owned)
+                if size is not None:
+                    self._set_size(entry, size)
+
+    def _claim(self, path) -> bool:
+        """摘除跟踪并标记为删除中（调用方持有锁）；本进程正在使用的目录不删除"""
+        if path in self._owned or path not in self._entries:
+            return False
+        self._untrack(path)
+        self._removing.add(path)
+        return True
+
+    def _remove_all(self, paths):
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._removing.difference_update(paths)
+
+    def enforce_quota(self):
+        if self.quota_bytes <= 0:
+            return
+        with self._lock:
+            if self._bytes <= self.quota_bytes:
+                return
+            # OrderedDict 头部为最久未访问
+            candidates = [
+                (path, entry["active"])
+                for path, entry in self._entries.items()
+                if path not in self._owned
+            ]
+        # 标记为活跃的目录在锁外确认标记是否仍然有效
+        candidates = [
+            path for path, active in candidates if not (active and self.is_active(path))
+        ]
+        victims = []
+        with self._lock:
+            for path in candidates:
+                if self._bytes <= self.quota_bytes:
+                    break
+                if self._claim(path):
+                    victims.append(path)
+                    self._evicted_total += 1
+        for path in victims:
+            print(f"工作目录超出配额，已淘汰: {path}")
+        self._remove_all(victims)
+
+    def sweep(self):
+        self._discover()
+        self._refresh()
+        if self.ttl_seconds > 0:
+            deadline = time.time() - self.ttl_seconds
+            with self._lock:
+                expired = [
+                    path
+                    for path, entry in list(self._entries.items())
+                    if entry["last_access"] < deadline
+                    and not entry["active"]
+                    and self._claim(path)
+                ]
+                self._expired_total += len(expired)
+            for path in expired:
+                print(f"工作目录已过期，已清理: {path}")
+            self._remove_all(expired)
+        self.enforce_quota()
+
+    def _sweep_loop(self):
+        while not self._stop_event.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"工作目录清理失败: {e}")
+
+    def start_sweeper(self):
+        if self._sweeper is not None:
+            return
+        self._stop_event.clear()
+        self._sweeper = threading.Thread(
+            target=self._sweep_loop, name="workspace-sweeper", daemon=True
+        )
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        if self._sweeper is None:
+            return
+        self._stop_event.set()
+        self._sweeper.join(timeout=5)
+        self._sweeper = None
+
+    def stats(self) -> dict:
+        """各项均为增量维护的计数，活跃目录的大小为上次后台清理时的统计值"""
+        with self._lock:
+            return {
+                "root": self.root,
+                "bytes_in_use": self._bytes,
+                "quota_bytes": self.quota_bytes,
+                "dirs": len(self._entries),
+                "active_dirs": self._active,
+                "evicted_total": self._evicted_total,
+                "expired_total": self._expired_total,
+            }
+
+
+_workspace = None
+_workspace_lock = threading.Lock()
+
+
+def get_workspace() -> WorkspaceManager:
+    global _workspace
+    with _workspace_lock:
+        if _workspace is None:
+            _workspace = WorkspaceManager(
+                root=os.getenv("WORKSPACE_ROOT", os.path.join(".", "temp")),
+                quota_bytes=int(os.getenv("WORKSPACE_QUOTA_MB", "0")) * 1024 * 1024,
+                ttl_seconds=int(os.getenv("WORKSPACE_TTL_SECONDS", "86400")),
+                sweep_interval=int(os.getenv("WORKSPACE_SWEEP_INTERVAL", "60")),
+            )
+        return _workspace
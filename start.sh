@@ -1,2 +1,6 @@
 #!/bin/bash
-nohup ./venv/bin/python ./src/main.py > run.log 2>&1 &
\ No newline at end of file
+nohup ./venv/bin/python ./src/main.py > run.log 2>&1 &
+# 队列模式下启动独立的 worker 进程（进程数由 WORKER_PROCESSES 控制）
+if [ "$DEPLOY_MODE" = "queue" ]; then
+    nohup ./venv/bin/python ./src/worker.py > worker.log 2>&1 &
+fi
@@ -1,2 +1,2 @@
 #!/bin/bash
-ps -ef | grep python |grep src/main.py | awk '{print $2}' |xargs -i kill -9 {}
\ No newline at end of file
+ps -ef | grep python |grep -E "src/(main|worker).py" | awk '{print $2}' |xargs -i kill -9 {}